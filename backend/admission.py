@@ -0,0 +1,238 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# The priorities of the routes, the lower ones are shed first when the worker is busy
+PRIORITIES = ('high', 'normal', 'low')
+# The fraction of ADMISSION_MAX_IN_FLIGHT a priority may fill: the low priority requests are shed once the worker
+# serves half its limit, the normal ones at 80% and the high ones only at the limit
+PRIORITY_SHARES = {'high': 1.0, 'normal': 0.8, 'low': 0.5}
+# The number of tokens of the client bucket a request of each priority takes, the high priority requests are never
+# rate limited and the low priority (expensive) ones count double
+PRIORITY_COSTS = {'high': 0, 'normal': 1, 'low': 2}
+# The priorities of the endpoints, the others are 'normal'. The cheap reads and the admin endpoints keep flowing, the
+# searches and the whole table exports and imports are shed first
+DEFAULT_ROUTE_PRIORITIES = {
+    'get_categories': 'high',
+    'get_metrics': 'high',
+    'get_cache_stats': 'high',
+    'get_pool_stats': 'high',
+    'get_results_buffer_stats': 'high',
+    'get_admission_stats': 'high',
+    'search_questions': 'low',
+    'export_all_questions': 'low',
+    'add_questions_in_bulk': 'low'
+}
+# The number of seconds a client is told to wait after a request was shed because the worker is busy
+ADMISSION_RETRY_AFTER = 1
+# The maximum number of clients buckets kept by the memory backend, the least recently seen one is dropped
+MAX_TRACKED_CLIENTS = 100000
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryLimiterBackend:
+    """
+    Keeps the clients token buckets in the process, each worker process limits the clients on its own
+    """
+
+    def __init__(self, max_clients=MAX_TRACKED_CLIENTS):
+        """
+        :param max_clients: the maximum number of buckets kept
+        """
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, cost, rate, burst):
+        """
+        A function that takes 'cost' tokens from the bucket of a client, the bucket refills at 'rate' tokens per second
+        up to 'burst' tokens
+        :param key: the key of the client
+        :param cost: the number of tokens the request takes
+        :param rate: the number of tokens added per second
+        :param burst: the capacity of the bucket
+        :return: a tuple of whether the tokens were taken and the number of tokens left
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+
+class RedisLimiterBackend:
+    """
+    Keeps the clients token buckets in Redis hashes so every worker process shares them, each take is a single atomic
+    script. 'client' is a redis-py client
+    """
+
+    TAKE_SCRIPT = """
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local cost, rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+        local tokens, updated_at = tonumber(bucket[1]) or burst, tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate)
+        local allowed = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+            allowed = 1
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, client, prefix='rate_limit:'):
+        self.client = client
+        self.prefix = prefix
+        self._take = client.register_script(self.TAKE_SCRIPT)
+
+    def take(self, key, cost, rate, burst):
+        allowed, tokens = self._take(keys=[self.prefix + key], args=[cost, rate, burst, time.time()])
+        return bool(allowed), float(tokens)
+
+
+class AdmissionController:
+    """
+    Decides whether a request is served or refused at once: a client over its rate gets a 429, and a route over its
+    concurrency limit (or a worker too busy for the route priority) gets a 503. Refusing early keeps the workers and
+    the database connections for the requests that can be served in time. When the backend of the buckets fails (Redis
+    is down) the requests are not rate limited until it is back
+    """
+
+    def __init__(self, backend, max_in_flight=None, route_limits=None, priorities=None, client_rate=None,
+                 client_burst=None):
+        """
+        :param backend: the backend of the clients token buckets (MemoryLimiterBackend or RedisLimiterBackend)
+        :param max_in_flight: the maximum number of requests served at once by the process, None for no limit
+        :param route_limits: a dictionary of endpoint to the maximum number of its requests served at once
+        :param priorities: a dictionary of endpoint to priority, merged over DEFAULT_ROUTE_PRIORITIES
+        :param client_rate: the number of requests per second of a client, None for no rate limit
+        :param client_burst: the number of tokens a client can spend at once, client_rate by default
+        """
+        self.backend = backend
+        self.max_in_flight = max_in_flight
+        self.route_limits = route_limits or {}
+        self.priorities = dict(DEFAULT_ROUTE_PRIORITIES, **(priorities or {}))
+        unknown_priorities = set(self.priorities.values()) - set(PRIORITIES)
+        if unknown_priorities:
+            raise ValueError(f"unknown priorities {', '.join(sorted(unknown_priorities))}, "
+                             f"use one of {', '.join(PRIORITIES)}")
+        self.client_rate = client_rate
+        # The bucket must hold the cost of the most expensive request or those requests would never pass
+        self.client_burst = max(client_burst or client_rate or 0, max(PRIORITY_COSTS.values()))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._route_in_flight = Counter()
+        self._admitted = Counter()
+        self._limited = Counter()
+        self._shed = Counter()
+        self._backend_errors = 0
+        self._backend_failing = False
+
+    def admit(self, endpoint, client):
+        """
+        A function that admits a request or tells why it is refused, an admitted request must be released
+        :param endpoint: the endpoint of the request, None when no route matched
+        :param client: the key of the client (its address)
+        :return: None if the request is admitted, otherwise a tuple of the status code (429 or 503), the message and
+         the number of seconds to wait before retrying
+        """
+        endpoint = endpoint or 'unmatched'
+        priority = self.priorities.get(endpoint, 'normal')
+        cost = PRIORITY_COSTS[priority]
+        if self.client_rate and cost:
+            allowed, tokens = self._take(client, cost)
+            if not allowed:
+                with self._lock:
+                    self._limited[endpoint] += 1
+                return 429, "too many requests, retry later", max(1, math.ceil((cost - tokens) / self.client_rate))
+        with self._lock:
+            route_limit = self.route_limits.get(endpoint)
+            if (route_limit is not None and self._route_in_flight[endpoint] >= route_limit) or \
+                    (self.max_in_flight and self._in_flight >= self.max_in_flight * PRIORITY_SHARES[priority]):
+                self._shed[endpoint] += 1
+                return 503, "the server is busy, retry later", ADMISSION_RETRY_AFTER
+            self._in_flight += 1
+            self._route_in_flight[endpoint] += 1
+            self._admitted[endpoint] += 1
+        return None
+
+    def _take(self, client, cost):
+        # Failing open: an error of the backend admits the request, it is logged once until the backend is back
+        try:
+            result = self.backend.take(client, cost, self.client_rate, self.client_burst)
+        except Exception:
+            with self._lock:
+                self._backend_errors += 1
+                was_failing, self._backend_failing = self._backend_failing, True
+            if not was_failing:
+                logger.exception("The rate limiter backend failed, the clients are not rate limited until it is back")
+            return True, self.client_burst
+        if self._backend_failing:
+            with self._lock:
+                self._backend_failing = False
+            logger.warning("The rate limiter backend is back, the clients are rate limited again")
+        return result
+
+    def release(self, endpoint):
+        """
+        A function that releases the slot of an admitted request once it is served
+        :param endpoint: the endpoint of the request, None when no route matched
+        """
+        endpoint = endpoint or 'unmatched'
+        with self._lock:
+            self._in_flight -= 1
+            self._route_in_flight[endpoint] -= 1
+            if not self._route_in_flight[endpoint]:
+                del self._route_in_flight[endpoint]
+
+    def stats(self):
+        """
+        A function that returns the state of the admission control of the process
+        :return: a dictionary of the requests in flight, the admitted, rate limited (429) and shed (503) requests
+         per endpoint and the number of requests admitted without rate limit because the backend failed
+        """
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'routes_in_flight': dict(self._route_in_flight),
+                'admitted': dict(self._admitted),
+                'limited': dict(self._limited),
+                'shed': dict(self._shed),
+                'backend_errors': self._backend_errors
+            }
+
+
+def make_admission_controller(config):
+    """
+    A function that returns the admission controller configured by the app config, or None when admission control
+    is off (none of ADMISSION_MAX_IN_FLIGHT, ADMISSION_ROUTE_LIMITS and ADMISSION_CLIENT_RATE is set).
+    ADMISSION_BACKEND is 'memory' (default), 'redis' (needs the redis package and REDIS_URL) or a backend object
+    :param config: the app config
+    :return: the AdmissionController, None when admission control is off
+    """
+    if not (config.get('ADMISSION_MAX_IN_FLIGHT') or config.get('ADMISSION_ROUTE_LIMITS')
+            or config.get('ADMISSION_CLIENT_RATE')):
+        return None
+    backend = config.get('ADMISSION_BACKEND', 'memory')
+    if backend == 'memory':
+        backend = MemoryLimiterBackend(config.get('ADMISSION_MAX_CLIENTS', MAX_TRACKED_CLIENTS))
+    elif backend == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("ADMISSION_BACKEND='redis' needs the redis package (pip install redis)")
+        backend = RedisLimiterBackend(redis.Redis.from_url(config['REDIS_URL']))
+    return AdmissionController(backend, config.get('ADMISSION_MAX_IN_FLIGHT'), config.get('ADMISSION_ROUTE_LIMITS'),
+                               config.get('ADMISSION_PRIORITIES'), config.get('ADMISSION_CLIENT_RATE'),
+                               config.get('ADMISSION_CLIENT_BURST'))
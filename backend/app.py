@@ -1,14 +1,31 @@
-from flaskr import create_app
-from models import setup_db
+import os
 
-# Creating an app instance
-app = create_app()
+# Making the blocking calls cooperative before anything imports them when serving with gevent
+if os.environ.get('SERVING_MODE') == 'gevent':
+    from serving import patch_for_gevent
+    patch_for_gevent()
+
+import logging
 
+from flaskr import create_app
+from serving import serve
+
+# Logging the startup time and the preloaded caches
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
 
-# Setting up SQLAlchemy
-setup_db(app)
+# Creating an app instance
+config = {}
+if 'DATABASE_URL' in os.environ:
+    config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+# DATABASE_REPLICA_URLS is a comma separated list of read replicas uris
+if os.environ.get('DATABASE_REPLICA_URLS'):
+    config['SQLALCHEMY_REPLICA_URIS'] = os.environ['DATABASE_REPLICA_URLS'].split(',')
+app = create_app(config)
 
 
-# Setting the entry point for the app
+# Setting the entry point for the app, SERVING_MODE is 'threaded' (default) or 'gevent' and SERVING_CONCURRENCY is the
+# number of requests served at once
 if __name__ == '__main__':
-    app.run()
+    concurrency = os.environ.get('SERVING_CONCURRENCY')
+    serve(app, os.environ.get('SERVING_MODE', 'threaded'), os.environ.get('HOST', '127.0.0.1'),
+          int(os.environ.get('PORT', 5000)), int(concurrency) if concurrency else None)
@@ -0,0 +1,59 @@
+"""
+Prints the PostgreSQL query plans and timings of the per category queries of the api.
+Run it before and after migrations/002_question_category_integer_fk.sql to compare the plans:
+
+    python benchmarks/category_query_plans.py postgresql://postgres@localhost:5432/trivia > before.txt
+    psql trivia < migrations/002_question_category_integer_fk.sql
+    python benchmarks/category_query_plans.py postgresql://postgres@localhost:5432/trivia > after.txt
+    diff before.txt after.txt
+
+The plans only differ on a large question bank, a small one is always scanned sequentially.
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+
+# The parameters are bound as strings so the queries run on a text as well as an integer category column
+QUERIES = [
+    ("questions in a category (GET /categories/<id>/questions)",
+     "SELECT id, question, answer, category, difficulty FROM questions WHERE category = :category"),
+    ("questions in a category after a cursor (paginated listing)",
+     "SELECT id, question, answer, category, difficulty FROM questions "
+     "WHERE category = :category AND id > :cursor ORDER BY id LIMIT 10"),
+    ("number of questions in a category (total_questions)",
+     "SELECT count(id) FROM questions WHERE category = :category"),
+    ("questions of a difficulty",
+     "SELECT id FROM questions WHERE difficulty = :difficulty"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database_url', help="the PostgreSQL database to explain the queries on")
+    parser.add_argument('--category', default='4', help="the category id used in the queries")
+    parser.add_argument('--difficulty', default='3', help="the difficulty used in the queries")
+    parser.add_argument('--cursor', default='0', help="the id after which the paginated query starts")
+    parser.add_argument('--runs', type=int, default=20, help="the number of timed runs per query")
+    args = parser.parse_args()
+
+    params = {'category': args.category, 'difficulty': args.difficulty, 'cursor': args.cursor}
+    engine = create_engine(args.database_url)
+    with engine.connect() as connection:
+        for title, query in QUERIES:
+            plan = connection.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"), params).fetchall()
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                connection.execute(text(query), params).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"== {title}")
+            print(query)
+            for line, in plan:
+                print(f"    {line}")
+            print(f"median {statistics.median(timings):.3f} ms, max {max(timings):.3f} ms over {args.runs} runs\n")
+
+
+if __name__ == '__main__':
+    main()
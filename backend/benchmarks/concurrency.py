@@ -0,0 +1,124 @@
+"""
+Compares how many requests in flight the serving modes of app.py sustain. For each mode the server is started in a
+subprocess, then the read endpoints are hit by more and more concurrent clients, the throughput, the p99 latency and the
+failed requests (errors and timeouts) of each level are printed as JSON.
+
+    DATABASE_URL=postgresql://postgres@localhost:5432/trivia python benchmarks/concurrency.py --levels 8 32 128 512
+
+The gevent mode needs the gevent and psycogreen packages. Run it against PostgreSQL, SQLite doesn't wait on the network
+so it doesn't show the difference between the modes.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+BACKEND_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READ_REQUESTS = [
+    ('GET', '/categories', None),
+    ('GET', '/questions?page=1', None),
+    ('GET', '/categories/1/questions', None),
+    ('POST', '/quizzes', {'quiz_category': {'id': 0}, 'previous_questions': []}),
+]
+
+
+def wait_until_up(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/categories')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"the server didn't start on port {port}")
+
+
+def run_level(port, clients, requests_per_client, timeout):
+    """
+    A function that sends requests with 'clients' concurrent clients
+    :return: a dictionary of the level results
+    """
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def client():
+        rng = random.Random()
+        client_latencies = []
+        client_failures = 0
+        for _ in range(requests_per_client):
+            method, path, body = rng.choice(READ_REQUESTS)
+            start = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+                headers = {'Content-Type': 'application/json'} if body is not None else {}
+                connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                if response.status >= 500:
+                    client_failures += 1
+                    continue
+            except OSError:
+                client_failures += 1
+                continue
+            client_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(client_latencies)
+            failures.append(client_failures)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] if latencies else None
+    return {
+        'clients': clients,
+        'succeeded': len(latencies),
+        'failed': sum(failures),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'p99_ms': round(p99 * 1000, 3) if p99 is not None else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'gevent'], help="the serving modes to compare")
+    parser.add_argument('--levels', nargs='+', type=int, default=[8, 32, 128], help="the numbers of concurrent "
+                                                                                     "clients")
+    parser.add_argument('--requests', type=int, default=20, help="the number of requests per client and level")
+    parser.add_argument('--concurrency', type=int, help="SERVING_CONCURRENCY of the server, the mode default if "
+                                                        "omitted")
+    parser.add_argument('--timeout', type=float, default=10, help="the seconds after which a request has failed")
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        env = dict(os.environ, SERVING_MODE=mode, PORT=str(args.port))
+        if args.concurrency:
+            env['SERVING_CONCURRENCY'] = str(args.concurrency)
+        server = subprocess.Popen([sys.executable, 'app.py'], cwd=BACKEND_DIRECTORY, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(args.port, timeout=30)
+            results[mode] = [run_level(args.port, clients, args.requests, args.timeout) for clients in args.levels]
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+Generates a synthetic question bank and measures the throughput and the latency of the main endpoints, the results
+are printed (or written to --output) as JSON so runs can be compared with --compare.
+
+    python benchmarks/load_test.py --rows 100000 --output before.json
+    python benchmarks/load_test.py --rows 100000 --compare before.json
+
+The requests go through the Flask test client in-process, so the numbers measure the app and the database without
+the network and the WSGI server. Without --database-url a temporary SQLite database is used, with a PostgreSQL url
+the database must exist and be empty or hold a bank generated by a previous run with the same --rows.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr import create_app, QUESTIONS_PER_PAGE  # noqa: E402
+from models import db, Question, Category, notify_question_change  # noqa: E402
+from duplicates import content_hash  # noqa: E402
+
+CATEGORIES = ["Science", "Art", "Geography", "History", "Entertainment", "Sports"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "su", "ra", "to", "vi", "ze", "po", "da", "gu", "shi", "ben", "tor", "al"]
+INSERT_CHUNK_SIZE = 10000
+
+
+def make_vocabulary(rng, size=2000):
+    """
+    A function that returns a list of random made up words
+    :param rng: the random generator
+    :param size: the number of words
+    :return: a list of words
+    """
+    return sorted({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)})
+
+
+def generate_bank(rows, rng, vocabulary):
+    """
+    A function that fills the database with 'rows' questions spread over the six categories, nothing is inserted if
+    the database already holds that many questions
+    :param rows: the number of questions
+    :param rng: the random generator
+    :param vocabulary: the words the questions are made of
+    """
+    if Category.query.count() == 0:
+        db.session.add_all([Category(category_type) for category_type in CATEGORIES])
+        db.session.commit()
+    existing = Question.query.count()
+    if existing >= rows:
+        return
+    table = Question.__table__
+    for start in range(existing, rows, INSERT_CHUNK_SIZE):
+        chunk = [{
+            'question': ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(5, 12))) + '?',
+            'answer': ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 3))),
+            'category': rng.randint(1, len(CATEGORIES)),
+            'difficulty': rng.randint(1, 5)
+        } for _ in range(min(INSERT_CHUNK_SIZE, rows - start))]
+        for row in chunk:
+            row['content_hash'] = content_hash(row['question'])
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+    notify_question_change('reset')
+
+
+def make_scenarios(rows, rng, vocabulary):
+    """
+    A function that returns the requests of each benchmarked endpoint
+    :return: a dictionary of scenario name to a function sending one request with a test client
+    """
+    last_page = max(rows // QUESTIONS_PER_PAGE, 1)
+
+    def questions_page(client):
+        return client.get(f'/questions?page={rng.randint(1, last_page)}')
+
+    def search(client):
+        return client.post('/questions/search', json={'searchTerm': rng.choice(vocabulary)[:4]})
+
+    def category_questions(client):
+        return client.get(f'/categories/{rng.randint(1, len(CATEGORIES))}/questions')
+
+    def quiz(client):
+        return client.post('/quizzes', json={
+            'quiz_category': {'id': rng.randint(0, len(CATEGORIES))},
+            'previous_questions': [rng.randint(1, rows) for _ in range(rng.randint(0, 4))]
+        })
+
+    return {
+        'GET /questions?page=N': questions_page,
+        'POST /questions/search': search,
+        'GET /categories/<id>/questions': category_questions,
+        'POST /quizzes': quiz,
+    }
+
+
+def run_scenario(app, send, requests, concurrency, warmup):
+    """
+    A function that sends 'requests' requests with 'concurrency' threads and measures them
+    :return: a dictionary of the scenario results
+    """
+    client = app.test_client()
+    for _ in range(warmup):
+        send(client)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    per_thread = [requests // concurrency + (1 if index < requests % concurrency else 0)
+                  for index in range(concurrency)]
+
+    def worker(count):
+        thread_client = app.test_client()
+        thread_latencies = []
+        thread_errors = 0
+        for _ in range(count):
+            start = time.perf_counter()
+            response = send(thread_client)
+            thread_latencies.append(time.perf_counter() - start)
+            # A search or a page without results answers 404, that is a valid outcome here
+            if response.status_code >= 500:
+                thread_errors += 1
+        with lock:
+            latencies.extend(thread_latencies)
+            errors.append(thread_errors)
+
+    threads = [threading.Thread(target=worker, args=(count,)) for count in per_thread]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies) * 1000, 3),
+            'p50': round(percentile(latencies, 0.50) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3)
+        }
+    }
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def compare(previous, current):
+    """
+    A function that prints the change of each scenario between two runs
+    """
+    for name, result in current['scenarios'].items():
+        before = previous.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        rps_change = (result['requests_per_second'] / before['requests_per_second'] - 1) * 100
+        p99_change = (result['latency_ms']['p99'] / before['latency_ms']['p99'] - 1) * 100
+        print(f"{name:35} req/s {before['requests_per_second']:>10} -> {result['requests_per_second']:>10} "
+              f"({rps_change:+.1f}%)  p99 {before['latency_ms']['p99']:>9} -> {result['latency_ms']['p99']:>9} ms "
+              f"({p99_change:+.1f}%)", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help="the database to benchmark, a temporary SQLite file by default")
+    parser.add_argument('--rows', type=int, default=1000, help="the number of questions in the bank (ex: 1000, "
+                                                               "100000, 1000000)")
+    parser.add_argument('--requests', type=int, default=500, help="the number of requests per endpoint")
+    parser.add_argument('--concurrency', type=int, default=1, help="the number of threads sending requests")
+    parser.add_argument('--warmup', type=int, default=20, help="the number of requests sent before measuring")
+    parser.add_argument('--seed', type=int, default=0, help="the seed of the generated data and requests")
+    parser.add_argument('--scenario', action='append', help="only run the scenarios containing this text")
+    parser.add_argument('--output', help="the file to write the JSON results to, stdout by default")
+    parser.add_argument('--compare', help="a previous JSON result to compare this run with")
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    database_file = None
+    if database_url is None:
+        database_file = tempfile.NamedTemporaryFile(prefix='trivia_bench_', suffix='.db', delete=False)
+        database_url = f'sqlite:///{database_file.name}'
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(rng)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'METRICS_ENABLED': False, 'DB_CREATE_ALL': True})
+
+    with app.app_context():
+        start = time.perf_counter()
+        generate_bank(args.rows, rng, vocabulary)
+        generation_seconds = time.perf_counter() - start
+        dialect = db.engine.dialect.name
+
+    results = {
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'database': dialect,
+        'rows': args.rows,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'generation_seconds': round(generation_seconds, 2),
+        'scenarios': {}
+    }
+    for name, send in make_scenarios(args.rows, rng, vocabulary).items():
+        if args.scenario and not any(text in name for text in args.scenario):
+            continue
+        results['scenarios'][name] = run_scenario(app, send, args.requests, args.concurrency, args.warmup)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(json.load(previous_file), results)
+    if database_file is not None:
+        os.unlink(database_file.name)
+
+
+if __name__ == '__main__':
+    main()
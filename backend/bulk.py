@@ -0,0 +1,257 @@
+import codecs
+import csv
+import json
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, notify_question_change
+from helper import query_question_rows, format_question_row, QUESTION_COLUMNS
+from duplicates import content_hash, minhash_signature
+
+# The number of rows inserted per executemany (and per transaction unless the import is atomic)
+IMPORT_CHUNK_SIZE = 1000
+# The number of bytes read at once from the request body
+READ_SIZE = 64 * 1024
+# The maximum number of row errors returned in the import report
+MAX_REPORTED_ERRORS = 100
+# The number of rows fetched per query while exporting
+EXPORT_BATCH_SIZE = 1000
+# The maximum number of ids of a batch fetch or a batch delete
+MAX_BATCH_IDS = 1000
+
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+def iter_request_rows(stream, mimetype):
+    """
+    A function that reads the rows of a bulk import from the request body without loading the whole body
+    :param stream: the raw request body stream
+    :param mimetype: the mimetype of the body, 'application/json' (array), 'application/x-ndjson' or 'text/csv'
+    :return: a generator of the rows as dictionaries, raises ValueError when the body can't be parsed
+    """
+    text_stream = codecs.getreader('utf-8')(stream)
+    if mimetype == 'text/csv':
+        return csv.DictReader(text_stream)
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return _iter_ndjson(text_stream)
+    return _iter_json_array(text_stream)
+
+
+def parse_question_row(row, categories_map):
+    """
+    A function that validates a row of a bulk import
+    :param row: the row as a dictionary
+    :param categories_map: the map of the available categories
+    :return: the values of the row ready to be inserted, raises ValueError with the reason if the row is invalid
+    """
+    if not isinstance(row, dict):
+        raise ValueError("the row must be an object")
+    unknown_fields = [field for field in row if field not in QUESTION_FIELDS]
+    if unknown_fields:
+        raise ValueError(f"invalid fields: {', '.join(str(field) for field in unknown_fields)}")
+    missing_fields = [field for field in QUESTION_FIELDS if row.get(field) in (None, '')]
+    if missing_fields:
+        raise ValueError(f"missing fields: {', '.join(missing_fields)}")
+    try:
+        difficulty = int(row['difficulty'])
+        category = int(row['category'])
+    except (TypeError, ValueError):
+        raise ValueError("category and difficulty must be numbers")
+    if str(category) not in categories_map:
+        raise ValueError(f"unknown category: {category}")
+    return {
+        'question': str(row['question']),
+        'answer': str(row['answer']),
+        'category': category,
+        'difficulty': difficulty,
+        'content_hash': content_hash(str(row['question'])),
+        'minhash': minhash_signature(str(row['question']))
+    }
+
+
+def import_questions(rows, categories_map, chunk_size=IMPORT_CHUNK_SIZE, atomic=False):
+    """
+    A function that validates and inserts the rows of a bulk import in chunks, each chunk is a single executemany
+    :param rows: an iterable of the rows as dictionaries
+    :param categories_map: the map of the available categories
+    :param chunk_size: the number of rows inserted at once
+    :param atomic: whether all the rows are committed in a single transaction instead of one per chunk
+    :return: a tuple of the number of inserted rows, the number of failed rows and the list of the row errors
+    """
+    inserted = 0
+    failed = 0
+    errors = []
+
+    def report(row_number, message):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'row': row_number, 'message': message})
+
+    def flush(chunk, first_row_number):
+        try:
+            db.session.execute(Question.__table__.insert(), chunk)
+            if not atomic:
+                db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            report(first_row_number, f"database error, the {len(chunk)} rows starting at this row were not inserted")
+            return 0
+        return len(chunk)
+
+    chunk = []
+    first_row_number = 1
+    row_number = 0
+    try:
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                chunk.append(parse_question_row(row, categories_map))
+            except ValueError as error:
+                failed += 1
+                report(row_number, str(error))
+                continue
+            if len(chunk) >= chunk_size:
+                flushed = flush(chunk, first_row_number)
+                inserted += flushed
+                failed += len(chunk) - flushed
+                chunk = []
+                first_row_number = row_number + 1
+    except (ValueError, csv.Error) as error:
+        # The body itself is malformed, the rows read so far are kept
+        failed += 1
+        report(row_number + 1, f"malformed body: {error}")
+    if chunk:
+        flushed = flush(chunk, first_row_number)
+        inserted += flushed
+        failed += len(chunk) - flushed
+    if atomic:
+        if failed:
+            db.session.rollback()
+            inserted = 0
+        else:
+            db.session.commit()
+    if inserted:
+        # The ids of the inserted rows are unknown, the listeners rebuild their state
+        notify_question_change('reset')
+    return inserted, failed, errors
+
+
+def export_questions(batch_size=EXPORT_BATCH_SIZE):
+    """
+    A function that yields all the questions as NDJSON lines, the questions are fetched in batches ordered by id so
+    the table is never loaded in memory
+    :param batch_size: the number of questions fetched per query
+    :return: a generator of NDJSON lines
+    """
+    last_id = 0
+    while True:
+        batch = query_question_rows().filter(Question.id > last_id).order_by(Question.id).limit(batch_size).all()
+        if not batch:
+            return
+        for row in batch:
+            yield json.dumps(format_question_row(row)) + '\n'
+        last_id = batch[-1][0]
+
+
+def parse_question_ids(values):
+    """
+    A function that validates the ids of a batch fetch or a batch delete
+    :param values: a list of ids (ints or strings of digits)
+    :return: the list of ids without duplicates in the given order, raises ValueError if an id is invalid (floats and
+     booleans included, they are never truncated to an id) or there are no ids or too many of them
+    """
+    if isinstance(values, (str, bytes)) or not isinstance(values, (list, tuple)):
+        raise ValueError("the ids must be a list")
+    ids = []
+    seen_ids = set()
+    for value in values:
+        if isinstance(value, str) and value.strip().isascii() and value.strip().isdigit():
+            question_id = int(value)
+        elif isinstance(value, int) and not isinstance(value, bool):
+            question_id = value
+        else:
+            raise ValueError(f"invalid id {value!r}")
+        if question_id not in seen_ids:
+            seen_ids.add(question_id)
+            ids.append(question_id)
+    if not ids or len(ids) > MAX_BATCH_IDS:
+        raise ValueError(f"between 1 and {MAX_BATCH_IDS} ids are allowed")
+    return ids
+
+
+def fetch_questions(ids):
+    """
+    A function that fetches many questions with a single query
+    :param ids: the list of the questions ids
+    :return: a map of id to the serialized question, the ids that don't exist are missing from it
+    """
+    rows = query_question_rows().filter(Question.id.in_(ids)).all()
+    return {row[0]: format_question_row(row) for row in rows}
+
+
+def delete_questions(ids):
+    """
+    A function that deletes many questions in a single transaction with a single DELETE statement (DELETE ... RETURNING
+    on PostgreSQL, the other databases select the rows first to tell the listeners which questions were deleted)
+    :param ids: the list of the questions ids
+    :return: a map of id to the serialized deleted question, the ids that didn't exist are missing from it, raises
+     SQLAlchemyError if the transaction failed (nothing is deleted then)
+    """
+    table = Question.__table__
+    statement = table.delete().where(table.c.id.in_(ids))
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            rows = db.session.execute(statement.returning(*(table.c[column.key] for column in QUESTION_COLUMNS)))\
+                .fetchall()
+        else:
+            rows = query_question_rows().filter(Question.id.in_(ids)).with_for_update().all()
+            db.session.execute(statement)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    deleted = {row[0]: format_question_row(row) for row in rows}
+    if deleted:
+        notify_question_change('delete', list(deleted.values()))
+    return deleted
+
+
+def _iter_ndjson(text_stream):
+    for line in text_stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Yielding the line as is so only this row is reported as invalid
+            yield line
+
+
+def _iter_json_array(text_stream):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: text_stream.read(READ_SIZE), ''):
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                break
+            if not started:
+                if buffer[0] != '[':
+                    raise ValueError("the body must be a JSON array")
+                started = True
+                buffer = buffer[1:]
+                continue
+            if buffer[0] == ',':
+                buffer = buffer[1:]
+                continue
+            if buffer[0] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                # The item is cut by the end of the chunk, reading more of the body
+                break
+            yield item
+            buffer = buffer[end:]
+    raise ValueError("the JSON array is not complete")
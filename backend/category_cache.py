@@ -0,0 +1,81 @@
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy import event
+
+from models import Category
+from helper import get_all_categories_map
+
+# The number of seconds the categories are kept before being loaded again from the database
+CATEGORY_CACHE_TTL = 300
+
+
+class CategoryCache:
+    """
+    An in-process cache of the categories map ({id1: type1, id2: type2, ....}) shared by every endpoint that needs it
+    """
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        """
+        :param ttl: the number of seconds after which the categories are loaded again from the database
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self.etag = None
+        self._lock = threading.Lock()
+        self._categories_map = None
+        self._loaded_at = None
+
+    def get_map(self):
+        """
+        A function that returns the categories map, loading it from the database if it is missing or expired
+        :return: a map of the available categories where keys are categories ids and values are categories types
+        """
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                self.hits += 1
+                return self._categories_map
+            self.misses += 1
+            categories_map = get_all_categories_map(Category.query.order_by('id').all())
+            # The version changes only when the categories themselves changed
+            if categories_map != self._categories_map:
+                self.version += 1
+                self.etag = hashlib.sha1(json.dumps(categories_map, sort_keys=True).encode()).hexdigest()
+            self._categories_map = categories_map
+            self._loaded_at = time.monotonic()
+            return categories_map
+
+    def invalidate(self):
+        """
+        A function that drops the cached categories, they get loaded from the database on the next request
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def stats(self):
+        """
+        A function that returns the counters of the cache
+        :return: a dictionary of hits, misses, version and size of the cache
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'version': self.version,
+                'size': len(self._categories_map or {})
+            }
+
+
+category_cache = CategoryCache()
+
+
+# Dropping the cache whenever a category is written through the ORM
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def invalidate_category_cache(mapper, connection, target):
+    category_cache.invalidate()
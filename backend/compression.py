@@ -0,0 +1,72 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The responses smaller than this number of bytes are sent uncompressed, the streamed responses are always compressed
+COMPRESSION_MIN_SIZE = 1024
+# The mimetypes of the responses worth compressing
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain')
+# The zlib level of gzip and the quality of brotli, both trade some ratio for a lot of speed
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def get_content_encodings():
+    """
+    A function that returns the encodings the api can compress with, brotli needs the brotli package
+    :return: a list of the encodings, the preferred one first
+    """
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress_response(response, accept_encodings, min_size=COMPRESSION_MIN_SIZE):
+    """
+    A function that compresses a response with the best encoding the client accepts, a streamed response is
+    compressed chunk by chunk as it is sent
+    :param response: the response to compress
+    :param accept_encodings: the Accept-Encoding header of the request (request.accept_encodings)
+    :param min_size: the size in bytes under which a response that is not streamed is sent uncompressed
+    :return: the response, compressed or not
+    """
+    if response.status_code in (204, 304) or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(get_content_encodings())
+    if encoding is None or (not response.is_streamed and response.calculate_content_length() < min_size):
+        return response
+    compress, finish = _get_compressor(encoding)
+    if response.is_streamed:
+        body = response.response
+        response.response = _compress_chunks(response.iter_encoded(), compress, finish)
+        if hasattr(body, 'close'):
+            response.call_on_close(body.close)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compress(response.get_data()) + finish())
+    response.headers['Content-Encoding'] = encoding
+    # The compressed body is a different representation, its ETag stays valid for the revalidations only as a weak one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def _get_compressor(encoding):
+    # The functions compressing a chunk and returning the end of the compressed stream
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _compress_chunks(chunks, compress, finish):
+    for chunk in chunks:
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
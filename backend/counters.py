@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import func
+
+from models import db, Question, on_question_change
+
+# The number of seconds the counts are kept before being counted again by the database
+COUNTERS_TTL = 30
+
+
+class QuestionCounters:
+    """
+    The total and per category numbers of questions, counted by the database with a single GROUP BY query and kept up
+    to date with the questions inserted or deleted through the Question model
+    """
+
+    def __init__(self, ttl=COUNTERS_TTL):
+        """
+        :param ttl: the number of seconds after which the questions are counted again, this picks up the questions
+         added or deleted by other processes
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._loaded_at = None
+
+    def total(self):
+        """
+        A function that returns the number of all the questions
+        :return: the number of questions in the database
+        """
+        with self._lock:
+            self._ensure_loaded()
+            return sum(self._counts.values())
+
+    def in_category(self, category):
+        """
+        A function that returns the number of questions in a category
+        :param category: the category id, 0 for all the categories
+        :return: the number of questions in that category
+        """
+        if category == 0:
+            return self.total()
+        with self._lock:
+            self._ensure_loaded()
+            return self._counts[category]
+
+    def invalidate(self):
+        """
+        A function that drops the counts, the questions get counted again on the next use
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def on_question_change(self, event, rows):
+        """
+        A listener keeping the counts in sync with the questions inserted or deleted through the Question model
+        """
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if event == 'insert':
+                for row in rows:
+                    self._counts[int(row['category'])] += 1
+            elif event == 'delete':
+                for row in rows:
+                    self._counts[int(row['category'])] -= 1
+            else:
+                self._loaded_at = None
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        counts = Counter()
+        for category, count in db.session.query(Question.category, func.count(Question.id)) \
+                .group_by(Question.category):
+            counts[int(category)] += count
+        self._counts = counts
+        self._loaded_at = time.monotonic()
+
+
+question_counters = QuestionCounters()
+on_question_change(question_counters.on_question_change)
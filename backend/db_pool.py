@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+# The app config keys (or environment variables) of the pool settings and the create_engine option each one sets
+POOL_SETTINGS = {
+    'DB_POOL_SIZE': ('pool_size', int),
+    'DB_MAX_OVERFLOW': ('max_overflow', int),
+    'DB_POOL_TIMEOUT': ('pool_timeout', int),
+    'DB_POOL_RECYCLE': ('pool_recycle', int),
+    'DB_POOL_PRE_PING': ('pool_pre_ping', lambda value: str(value).lower() in ('1', 'true', 'yes')),
+}
+# The number of recent checkouts kept to compute the latency percentiles
+LATENCY_SAMPLES = 1024
+
+
+class PoolMetrics:
+    """
+    The counters of the connections checked out from a pool, used to size the workers against the database. Each
+    instrumented pool (the primary and each replica) keeps its own
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.max_latency = 0.0
+        self._total_latency = 0.0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def record_checkout(self, latency):
+        with self._lock:
+            self.checkouts += 1
+            self._total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._latencies.append(latency)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        """
+        A function that returns the checkout counters
+        :return: a dictionary of the number of checkouts and timeouts and the checkout latencies in milliseconds
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            checkouts = self.checkouts
+            average = self._total_latency / checkouts if checkouts else 0.0
+            return {
+                'checkouts': checkouts,
+                'timeouts': self.timeouts,
+                'checkout_latency_ms': {
+                    'avg': round(average * 1000, 3),
+                    'p50': round(_percentile(latencies, 0.5) * 1000, 3),
+                    'p99': round(_percentile(latencies, 0.99) * 1000, 3),
+                    'max': round(self.max_latency * 1000, 3)
+                }
+            }
+
+
+class InstrumentedPoolMixin:
+    """
+    Times every connection checkout (waiting for a free connection included), counts the checkout timeouts and the
+    connections in use (the pools like NullPool don't keep that count themselves)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+        self._in_use_lock = threading.Lock()
+        self.in_use = 0
+        event.listen(self, 'checkout', self._count_checkout)
+        event.listen(self, 'checkin', self._count_checkin)
+
+    def _count_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._in_use_lock:
+            self.in_use += 1
+
+    def _count_checkin(self, dbapi_connection, connection_record):
+        with self._in_use_lock:
+            self.in_use -= 1
+
+    def recreate(self):
+        # The pool replacing this one (engine.dispose()) keeps counting in the same metrics
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self.metrics.record_timeout()
+            raise
+        self.metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedNullPool(InstrumentedPoolMixin, NullPool):
+    pass
+
+
+def get_engine_options(config, db_path):
+    """
+    A function that returns the create_engine options of the pool, each setting is read from the app config then from
+    the environment. DB_NULL_POOL opens a new connection per checkout (for PgBouncer setups)
+    :param config: the app config
+    :param db_path: the database uri
+    :return: a dictionary of create_engine options
+    """
+    def setting(key):
+        return config.get(key, os.environ.get(key))
+
+    url = make_url(db_path)
+    if url.drivername.startswith('sqlite'):
+        # In-memory SQLite databases get their pool from Flask-SQLAlchemy, SQLite connections can't be shared between
+        # threads so file databases open one per checkout (the SQLAlchemy default for them)
+        if url.database in (None, '', ':memory:'):
+            return {}
+        return {'poolclass': InstrumentedNullPool}
+    if str(setting('DB_NULL_POOL')).lower() in ('1', 'true', 'yes'):
+        options = {'poolclass': InstrumentedNullPool}
+        pre_ping = setting('DB_POOL_PRE_PING')
+        if pre_ping is not None:
+            options['pool_pre_ping'] = POOL_SETTINGS['DB_POOL_PRE_PING'][1](pre_ping)
+        return options
+    options = {'poolclass': InstrumentedQueuePool}
+    for key, (option, parse) in POOL_SETTINGS.items():
+        value = setting(key)
+        if value is not None:
+            options[option] = parse(value)
+    return options
+
+
+def get_pool_status(pool):
+    """
+    A function that returns the state of the pool and its checkout counters, the counters are zero for a pool that is
+    not instrumented
+    :param pool: the pool of the engine
+    :return: a dictionary describing the pool
+    """
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow
+        })
+    else:
+        # The connections in use counted by InstrumentedPoolMixin, None for a pool that is not instrumented (the
+        # in-memory SQLite pool of Flask-SQLAlchemy)
+        status['checked_out'] = getattr(pool, 'in_use', None)
+    status.update(getattr(pool, 'metrics', PoolMetrics()).snapshot())
+    return status
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
@@ -0,0 +1,184 @@
+import threading
+import time
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, BaseQuery
+from sqlalchemy import event, exc, orm
+from sqlalchemy.sql.expression import UpdateBase
+
+# The number of seconds a replica that failed is skipped before being tried again
+REPLICA_RETRY_SECONDS = 30
+# The prefix of the SQLALCHEMY_BINDS keys of the replicas
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+class ReplicaRouter:
+    """
+    Picks the replica serving the next read, the replicas are used in turn (round robin) and a replica whose
+    connection failed is skipped for 'retry_seconds'. Reads go to the primary when no replica is healthy
+    """
+
+    def __init__(self, retry_seconds=REPLICA_RETRY_SECONDS):
+        """
+        :param retry_seconds: the number of seconds a failed replica is skipped
+        """
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._names = []
+        self._next = 0
+        self._down_until = {}
+        self._failures = {}
+
+    def configure(self, names):
+        """
+        A function that sets the replicas to route the reads to
+        :param names: the SQLALCHEMY_BINDS keys of the replicas
+        """
+        with self._lock:
+            self._names = list(names)
+            self._next = 0
+            self._down_until = {}
+            self._failures = {name: 0 for name in self._names}
+
+    def choose(self):
+        """
+        A function that returns the replica serving the next read
+        :return: the bind key of a healthy replica, None if there is no healthy replica
+        """
+        with self._lock:
+            now = time.monotonic()
+            for _ in range(len(self._names)):
+                name = self._names[self._next]
+                self._next = (self._next + 1) % len(self._names)
+                if self._down_until.get(name, 0) <= now:
+                    return name
+            return None
+
+    def mark_down(self, name):
+        """
+        A function that skips a replica for 'retry_seconds' after its connection failed
+        :param name: the bind key of the replica
+        """
+        with self._lock:
+            self._down_until[name] = time.monotonic() + self.retry_seconds
+            self._failures[name] = self._failures.get(name, 0) + 1
+
+    def status(self):
+        """
+        A function that returns the health of the replicas
+        :return: a list of dictionaries of name, healthy and failures of each replica
+        """
+        with self._lock:
+            now = time.monotonic()
+            return [{
+                'name': name,
+                'healthy': self._down_until.get(name, 0) <= now,
+                'failures': self._failures.get(name, 0)
+            } for name in self._names]
+
+
+replica_router = ReplicaRouter()
+
+
+def get_replica_binds(replica_paths):
+    """
+    A function that returns the SQLALCHEMY_BINDS entries of the replicas
+    :param replica_paths: the list of the replicas database uris
+    :return: a dictionary of bind key to database uri
+    """
+    return {f'{REPLICA_BIND_PREFIX}{number}': path for number, path in enumerate(replica_paths)}
+
+
+def is_connection_error(error):
+    """
+    A function that tells whether a database error comes from the connection (the server is down or unreachable)
+    rather than from the statement
+    :param error: the SQLAlchemy exception
+    :return: True for an OperationalError or an InterfaceError
+    """
+    return isinstance(error, (exc.OperationalError, exc.InterfaceError))
+
+
+def watch_replica(engine, name):
+    """
+    A function that marks a replica down when one of its connections fails
+    :param engine: the engine of the replica
+    :param name: the bind key of the replica
+    """
+    @event.listens_for(engine, 'handle_error')
+    def mark_replica_down(context):
+        if is_connection_error(context.sqlalchemy_exception):
+            replica_router.mark_down(name)
+
+
+def read_from_replicas(read_only):
+    """
+    A function that chooses whether the reads of the current request may go to the replicas
+    :param read_only: whether the request only reads (a GET or a read only POST like a search)
+    """
+    g.db_read_only = read_only
+
+
+class RoutingSession(SignallingSession):
+    """
+    A session sending the reads of the read only requests to the replicas, everything else goes to the primary: the
+    flushes (Question.insert(), update() and delete()), the INSERT, UPDATE and DELETE statements and any read
+    outside a request. Once a request wrote, its next reads go to the primary too so it reads its own writes, and
+    once a read failed on a replica the request reads from the primary (see retry_on_primary)
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        # The replica chosen for the statement, read by retry_on_primary when the statement fails
+        if has_request_context():
+            g.db_replica = None
+        if self._flushing or isinstance(clause, UpdateBase):
+            if has_request_context():
+                g.db_wrote = True
+            return super().get_bind(mapper, clause)
+        if has_request_context() and g.get('db_read_only') and not g.get('db_wrote') and not g.get('db_replica_failed'):
+            g.db_replica = replica_router.choose()
+            if g.db_replica is not None:
+                return self.app.extensions['sqlalchemy'].db.get_engine(self.app, bind=g.db_replica)
+        return super().get_bind(mapper, clause)
+
+    def execute(self, clause, params=None, mapper=None, bind=None, **kw):
+        return retry_on_primary(lambda: super(RoutingSession, self).execute(clause, params, mapper, bind, **kw))
+
+
+class RoutingQuery(BaseQuery):
+    """
+    The query of the RoutingSession, a read that failed on a replica is run again on the primary
+    """
+
+    def __iter__(self):
+        return retry_on_primary(super().__iter__)
+
+
+def retry_on_primary(read):
+    """
+    A function that runs a read and, when it failed because its replica is down, runs it again on the primary: the
+    replica is marked down (see watch_replica) and the next reads of the request go to the primary, so the client gets
+    its response instead of a 500
+    :param read: the function running the read
+    :return: the result of the read
+    """
+    try:
+        return read()
+    except exc.DBAPIError as error:
+        if not is_connection_error(error) or not has_request_context() or g.get('db_replica') is None:
+            raise
+        g.db_replica_failed = True
+        return read()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    The Flask-SQLAlchemy extension with sessions routing the reads to the replicas (see RoutingSession)
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('query_class', RoutingQuery)
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
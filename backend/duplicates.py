@@ -0,0 +1,391 @@
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import bindparam, event, func
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, on_question_change
+
+# The number of MinHash values of a question signature
+MINHASH_PERMUTATIONS = 64
+# The signature is split in LSH_BANDS bands of MINHASH_PERMUTATIONS / LSH_BANDS values, two questions sharing a band
+# are compared. With 16 bands of 4 values, questions about 50% similar or more have a good chance to be compared
+LSH_BANDS = 16
+# The estimated similarity (Jaccard of the character shingles) from which two questions are near duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# The number of characters of a shingle
+SHINGLE_SIZE = 4
+# The policies of POST /questions for a new question that duplicates existing ones
+DUPLICATE_POLICIES = ('warn', 'reject', 'off')
+# The number of seconds after which the bands are caught up in the background with the questions of other processes
+DUPLICATE_INDEX_TTL = 60
+# The number of questions read and hashed at once while catching up
+REFRESH_BATCH_SIZE = 1000
+
+_ROWS_PER_BAND = MINHASH_PERMUTATIONS // LSH_BANDS
+# The number of bytes of a band of a packed signature
+_BAND_SIZE = _ROWS_PER_BAND * 8
+# The masks XORed with the shingles hashes, each one gives a different hash function. The seed is fixed so the
+# signatures are the same in every process
+_MASKS = [random.Random(f'minhash-{number}').getrandbits(64) for number in range(MINHASH_PERMUTATIONS)]
+_NON_WORD = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(text):
+    """
+    A function that returns the text of a question stripped of what doesn't change its meaning: the case, the
+    punctuation and the extra spaces
+    :param text: the question text
+    :return: the normalized text
+    """
+    return _SPACES.sub(' ', _NON_WORD.sub(' ', text.lower())).strip()
+
+
+def content_hash(text):
+    """
+    A function that returns the hash of the normalized text, two questions with the same hash are exact duplicates.
+    It is stored in the indexed questions.content_hash column (migrations/004_question_content_hash.sql computes the
+    same md5 in SQL)
+    :param text: the question text
+    :return: the hex digest of the normalized text
+    """
+    return hashlib.md5(normalize(text).encode('utf-8')).hexdigest()
+
+
+def minhash_signature(text):
+    """
+    A function that returns the MinHash signature of the character shingles of the normalized text, packed with the
+    hashes of its bands
+    :param text: the question text
+    :return: the bytes of MINHASH_PERMUTATIONS + LSH_BANDS unsigned 64 bits ints in little endian order, the way they
+     are stored in the questions.minhash column
+    """
+    normalized = normalize(text)
+    shingles = {normalized[start:start + SHINGLE_SIZE]
+                for start in range(max(len(normalized) - SHINGLE_SIZE + 1, 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+              for shingle in shingles]
+    values = array('Q', [min(value ^ mask for value in hashes) for mask in _MASKS])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    signature = values.tobytes()
+    # Hashing each band with its number, the same values in two different bands are different buckets
+    band_hashes = b''.join(hashlib.blake2b(signature[band * _BAND_SIZE:(band + 1) * _BAND_SIZE], digest_size=8,
+                                           salt=band.to_bytes(16, 'little')).digest()
+                           for band in range(LSH_BANDS))
+    return signature + band_hashes
+
+
+def similarity(signature, other_signature):
+    """
+    A function that estimates the similarity of two questions from their packed signatures
+    :return: the fraction of the MinHash values the signatures share, between 0 and 1
+    """
+    values = memoryview(signature).cast('Q')
+    other_values = memoryview(other_signature).cast('Q')
+    return sum(values[position] == other_values[position]
+               for position in range(MINHASH_PERMUTATIONS)) / MINHASH_PERMUTATIONS
+
+
+def _band_hashes(signature):
+    # The hashes of the bands are packed after the MinHash values, they key the buckets. They are read in the byte order
+    # of the machine, which changes their values but not which of them are equal
+    return memoryview(signature).cast('Q')[MINHASH_PERMUTATIONS:].tolist()
+
+
+class DuplicateIndex:
+    """
+    Finds the questions duplicating a new one: the exact duplicates by the indexed content_hash column, the near ones
+    with an in-memory index of the MinHash LSH bands, a new question is compared only with the questions sharing one of
+    its bands instead of the whole bank. The bands are built and caught up by the questions ids in the background
+    (see refresh), a request never waits for them and uses the questions indexed so far. The signatures are read from
+    the questions.minhash column, only the questions without one are hashed (and their signature stored)
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD, ttl=DUPLICATE_INDEX_TTL):
+        """
+        :param threshold: the estimated similarity from which two questions are near duplicates
+        :param ttl: the number of seconds after which the bands are caught up with the database in the background, this
+         picks up the questions added or deleted by other processes
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        # The ids of the questions sharing a band by the hash of the band, an int for a single question (most of the
+        # bands) and a set for more
+        self._buckets = {}
+        # The packed signature of the indexed questions by id
+        self._signatures = {}
+        self._last_id = 0
+        self._refreshed_at = None
+        # Incremented when the bands are dropped, a refresh started before doesn't apply its rows
+        self._generation = 0
+        self._refresh_thread = None
+        self._refresh_requested = False
+        # Whether a refresh is reading the database and the ids removed meanwhile, the refresh must not add them back
+        self._refreshing = False
+        self._removed_ids = set()
+
+    def invalidate(self):
+        """
+        A function that drops the bands, they get built again in the background on their next use
+        """
+        with self._lock:
+            self._buckets = {}
+            self._signatures = {}
+            self._last_id = 0
+            self._refreshed_at = None
+            self._generation += 1
+
+    def size(self):
+        """
+        A function that returns the number of questions in the bands
+        :return: the number of indexed questions
+        """
+        with self._lock:
+            return len(self._signatures)
+
+    def refresh(self):
+        """
+        A function that catches the bands up with the database: the questions with an id above the last indexed one are
+        read with their stored signature in batches of REFRESH_BATCH_SIZE, and the questions deleted by other processes
+        are dropped. The questions without a stored signature are hashed and their signature stored for the other
+        workers. The index keeps answering meanwhile with the questions indexed so far
+        """
+        with self._refresh_lock:
+            with self._lock:
+                last_id = self._last_id
+                generation = self._generation
+                self._refreshing = True
+            try:
+                if last_id:
+                    existing_ids = {question_id for question_id, in
+                                    db.session.query(Question.id).filter(Question.id <= last_id)}
+                    with self._lock:
+                        if generation != self._generation:
+                            return
+                        for question_id in [question_id for question_id in self._signatures
+                                            if question_id <= last_id and question_id not in existing_ids]:
+                            self.remove(question_id)
+                while True:
+                    rows = db.session.query(Question.id, Question.question, Question.minhash) \
+                        .filter(Question.id > last_id).order_by(Question.id).limit(REFRESH_BATCH_SIZE).all()
+                    if not rows:
+                        break
+                    signatures = [(question_id, bytes(signature) if signature else minhash_signature(text))
+                                  for question_id, text, signature in rows]
+                    missing = [{'question_id': question_id, 'minhash': signature}
+                               for (question_id, _, stored), (_, signature) in zip(rows, signatures) if not stored]
+                    if missing:
+                        self._store_signatures(missing)
+                    last_id = rows[-1][0]
+                    with self._lock:
+                        if generation != self._generation:
+                            return
+                        for question_id, signature in signatures:
+                            if question_id not in self._signatures and question_id not in self._removed_ids:
+                                self._add_signature(question_id, signature)
+                        self._last_id = last_id
+                with self._lock:
+                    if generation == self._generation:
+                        self._refreshed_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+                    self._removed_ids.clear()
+
+    def find(self, text, exclude_id=None):
+        """
+        A function that returns the questions duplicating a text
+        :param text: the question text
+        :param exclude_id: the id of a question to leave out (the question itself)
+        :return: a list of dictionaries of id, similarity and exact, the most similar first
+        """
+        signature = minhash_signature(text)
+        # The exact duplicates come from the database, they are found even before the bands are built
+        exact_ids = {question_id for question_id, in
+                     db.session.query(Question.id).filter(Question.content_hash == content_hash(text))}
+        exact_ids.discard(exclude_id)
+        duplicates = [{'id': question_id, 'similarity': 1.0, 'exact': True} for question_id in exact_ids]
+        with self._lock:
+            self._schedule_refresh()
+            candidate_ids = set()
+            for band_hash in _band_hashes(signature):
+                bucket = self._buckets.get(band_hash)
+                if isinstance(bucket, set):
+                    candidate_ids |= bucket
+                elif bucket is not None:
+                    candidate_ids.add(bucket)
+            candidate_ids -= exact_ids
+            candidate_ids.discard(exclude_id)
+            for question_id in candidate_ids:
+                score = similarity(signature, self._signatures[question_id])
+                if score >= self.threshold:
+                    duplicates.append({'id': question_id, 'similarity': round(score, 3), 'exact': False})
+        return sorted(duplicates, key=lambda duplicate: (-duplicate['similarity'], duplicate['id']))
+
+    def add(self, question_id, text):
+        """
+        A function that adds a question to the bands
+        :param question_id: the id of the question
+        :param text: the question text
+        """
+        signature = minhash_signature(text)
+        with self._lock:
+            if question_id not in self._signatures:
+                self._add_signature(question_id, signature)
+
+    def remove(self, question_id):
+        """
+        A function that removes a question from the bands
+        :param question_id: the id of the question
+        """
+        with self._lock:
+            if self._refreshing:
+                self._removed_ids.add(question_id)
+            signature = self._signatures.pop(question_id, None)
+            if signature is None:
+                return
+            for band_hash in _band_hashes(signature):
+                bucket = self._buckets.get(band_hash)
+                if isinstance(bucket, set):
+                    bucket.discard(question_id)
+                    if len(bucket) == 1:
+                        self._buckets[band_hash] = bucket.pop()
+                elif bucket == question_id:
+                    del self._buckets[band_hash]
+
+    def groups(self):
+        """
+        A function that returns the groups of duplicated questions of the whole bank, two questions are in the same
+        group when they are duplicates directly or through other questions of the group. The bands are caught up first
+        :return: a list of the groups, each a sorted list of questions ids, the largest groups first
+        """
+        self.refresh()
+        parents = {}
+
+        def find_root(question_id):
+            while parents.get(question_id, question_id) != question_id:
+                question_id = parents[question_id]
+            return question_id
+
+        links = []
+        # The exact duplicates, grouped by the database
+        duplicated_hashes = db.session.query(Question.content_hash).filter(Question.content_hash.isnot(None)) \
+            .group_by(Question.content_hash).having(func.count(Question.id) > 1)
+        previous_hash, previous_id = None, None
+        for text_hash, question_id in db.session.query(Question.content_hash, Question.id) \
+                .filter(Question.content_hash.in_(duplicated_hashes)).order_by(Question.content_hash, Question.id):
+            if text_hash == previous_hash:
+                links.append((previous_id, question_id))
+            previous_hash, previous_id = text_hash, question_id
+        # The near duplicates, compared within the bands
+        with self._lock:
+            pairs = set()
+            for bucket in self._buckets.values():
+                if not isinstance(bucket, set):
+                    continue
+                ordered = sorted(bucket)
+                for position, question_id in enumerate(ordered):
+                    for other_id in ordered[position + 1:]:
+                        pairs.add((question_id, other_id))
+            links.extend((question_id, other_id) for question_id, other_id in pairs
+                         if similarity(self._signatures[question_id], self._signatures[other_id]) >= self.threshold)
+        duplicated_ids = set()
+        for question_id, other_id in links:
+            parents[find_root(other_id)] = find_root(question_id)
+            duplicated_ids.update((question_id, other_id))
+        members = defaultdict(list)
+        for question_id in duplicated_ids:
+            members[find_root(question_id)].append(question_id)
+        return sorted((sorted(group) for group in members.values()), key=lambda group: (-len(group), group[0]))
+
+    def on_question_change(self, event, rows):
+        """
+        A listener keeping the bands in sync with the questions inserted or deleted through the Question model
+        """
+        if event == 'insert':
+            for row in rows:
+                self.add(row['id'], row['question'])
+        elif event == 'delete':
+            for row in rows:
+                self.remove(row['id'])
+        else:
+            # Many questions were added at once (a bulk import), catching up with them in the background
+            self._refresh_in_background()
+
+    def _add_signature(self, question_id, signature):
+        self._signatures[question_id] = signature
+        for band_hash in _band_hashes(signature):
+            bucket = self._buckets.setdefault(band_hash, question_id)
+            if isinstance(bucket, set):
+                bucket.add(question_id)
+            elif bucket != question_id:
+                self._buckets[band_hash] = {bucket, question_id}
+
+    def _store_signatures(self, rows):
+        # Storing the signatures of the questions written without one (by another process or before the minhash column),
+        # the other workers read them instead of hashing the questions again. A failure only costs the hashing again
+        try:
+            db.session.execute(Question.__table__.update().where(Question.id == bindparam('question_id'))
+                               .where(Question.minhash.is_(None)).values(minhash=bindparam('minhash')), rows)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+
+    def _schedule_refresh(self):
+        # Catching up in the background when the bands were never built or are older than 'ttl' seconds
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.ttl:
+            self._refresh_in_background()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresh_thread is not None:
+                # The running refresh catches up once more when it is done
+                self._refresh_requested = True
+                return
+            self._refresh_thread = threading.Thread(target=self._run_refreshes,
+                                                    args=(current_app._get_current_object(),),
+                                                    name='duplicate-index-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def _run_refreshes(self, app):
+        refreshing = True
+        try:
+            with app.app_context():
+                while refreshing:
+                    self.refresh()
+                    with self._lock:
+                        refreshing = self._refresh_requested
+                        self._refresh_requested = False
+                        if not refreshing:
+                            self._refresh_thread = None
+        finally:
+            if refreshing:
+                with self._lock:
+                    # A failed refresh is tried again after another 'ttl' seconds
+                    self._refreshed_at = time.monotonic()
+                    self._refresh_requested = False
+                    self._refresh_thread = None
+
+
+duplicate_index = DuplicateIndex()
+on_question_change(duplicate_index.on_question_change)
+
+
+# Storing the content hash and the signature of the questions written through the ORM, the exact duplicates are looked
+# up by the hash and the workers read the signature instead of hashing the question
+@event.listens_for(Question, 'before_insert')
+@event.listens_for(Question, 'before_update')
+def set_content_hash(mapper, connection, target):
+    target.content_hash = content_hash(target.question)
+    target.minhash = minhash_signature(target.question)
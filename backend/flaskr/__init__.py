@@ -1,18 +1,97 @@
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, request, abort, g, stream_with_context
 from flask_cors import CORS
+import click
+import json
+import math
+import os
 import random
+import time
 
-from models import setup_db, Question, Category
-from helper import get_paginated_data, get_all_categories_map, get_next_question
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import setup_db, db, database_path, Question
+from helper import get_paginated_data, get_next_question, query_question_rows, format_question_row, \
+    get_target_difficulty, get_difficulty_order, shuffle_in_chunks
+from question_index import question_index
+from category_cache import category_cache, CATEGORY_CACHE_TTL
+from search import search_questions as search_questions_index
+from counters import question_counters
+from bulk import iter_request_rows, import_questions, export_questions, parse_question_ids, fetch_questions, \
+    delete_questions
+from db_pool import get_pool_status
+from db_routing import replica_router, read_from_replicas, REPLICA_RETRY_SECONDS
+from metrics import request_metrics, server_timing_header
+from sessions import QuizSessions, make_session_backend, QUIZ_DECK_SIZE
+from startup import init_db, preload_caches, is_enabled
+from snapshot import snapshot_store, SNAPSHOT_REBUILD_DELAY
+from duplicates import duplicate_index, DUPLICATE_POLICIES, NEAR_DUPLICATE_THRESHOLD, DUPLICATE_INDEX_TTL
+from results import results_buffer, get_question_stats, parse_answers, RESULTS_BUFFER_SIZE, RESULTS_FLUSH_INTERVAL, \
+    RESULTS_BATCH_SIZE
+from json_response import jsonify, stream_jsonify, get_json_encoder_backend
+from compression import compress_response, COMPRESSION_MIN_SIZE
+from admission import make_admission_controller
+from profiling import request_profiler, profile_store, should_profile, has_profile_token, render_profile, \
+    is_gevent_patched, PROFILE_HEADER, PROFILERS, PROFILE_BUFFER_SIZE, PROFILE_SAMPLE_INTERVAL, PROFILE_FORMATS
+from response_cache import response_cache, cached_listing, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
 
 QUESTIONS_PER_PAGE = 10
 LENGTH_CATEGORIES = 6
+# The number of seconds browsers and CDNs may keep the categories before revalidating them
+CATEGORIES_MAX_AGE = 60
+# The number of questions from which a category listing is streamed instead of being serialized in memory
+LISTING_STREAM_THRESHOLD = 1000
+# The number of questions fetched per round trip (and shuffled together) by a streamed listing
+LISTING_STREAM_CHUNK_SIZE = 500
+# The POST endpoints that only read, their reads go to the replicas like the GET endpoints ones
+READ_ONLY_POST_ENDPOINTS = ('search_questions', 'play_game', 'next_quiz_session_question')
 
 
 def create_app(test_config=None):
     # create and configure the app
+    started_at = time.perf_counter()
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.update(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path), app.config.get('SQLALCHEMY_REPLICA_URIS'))
+    replica_router.retry_seconds = app.config.get('REPLICA_RETRY_SECONDS', REPLICA_RETRY_SECONDS)
+    # Resolving the JSON encoder of the responses once, orjson when it is installed unless JSON_ENCODER_BACKEND='json'
+    app.config['JSON_ENCODER_BACKEND'] = get_json_encoder_backend(app.config)
+    category_cache.ttl = app.config.get('CATEGORY_CACHE_TTL', CATEGORY_CACHE_TTL)
+    response_cache.max_entries = app.config.get('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE)
+    response_cache.ttl = app.config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL)
+    quiz_sessions = QuizSessions(make_session_backend(app.config), question_index,
+                                 app.config.get('QUIZ_DECK_SIZE', QUIZ_DECK_SIZE))
+    # Writing the quiz results in the background, the buffer refuses new results once it holds QUIZ_RESULTS_BUFFER_SIZE
+    results_buffer.max_size = app.config.get('QUIZ_RESULTS_BUFFER_SIZE', RESULTS_BUFFER_SIZE)
+    results_buffer.flush_interval = app.config.get('QUIZ_RESULTS_FLUSH_INTERVAL', RESULTS_FLUSH_INTERVAL)
+    results_buffer.batch_size = app.config.get('QUIZ_RESULTS_BATCH_SIZE', RESULTS_BATCH_SIZE)
+    results_buffer.start(app)
+    # Checking the new questions against the bank, DUPLICATE_POLICY is 'warn' (default), 'reject' or 'off'
+    duplicate_policy = app.config.get('DUPLICATE_POLICY', 'warn')
+    if duplicate_policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"unknown duplicate policy '{duplicate_policy}', use one of {', '.join(DUPLICATE_POLICIES)}")
+    duplicate_index.threshold = app.config.get('DUPLICATE_THRESHOLD', NEAR_DUPLICATE_THRESHOLD)
+    duplicate_index.ttl = app.config.get('DUPLICATE_INDEX_TTL', DUPLICATE_INDEX_TTL)
+    # Refusing the requests at once under overload when ADMISSION_MAX_IN_FLIGHT, ADMISSION_ROUTE_LIMITS or
+    # ADMISSION_CLIENT_RATE is set, None otherwise
+    admission_controller = make_admission_controller(app.config)
+    # Profiling the requests carrying the PROFILE_TOKEN in their X-Profile header and a PROFILE_SAMPLE_RATE fraction of
+    # the others, with PROFILER 'cprofile' (default) or 'sampling'. cProfile records every greenlet of the thread, so
+    # under gevent (SERVING_MODE=gevent) only the sampling profiler can tell a request apart and it is the default
+    profile_token = app.config.get('PROFILE_TOKEN', os.environ.get('PROFILE_TOKEN'))
+    profile_sample_rate = float(app.config.get('PROFILE_SAMPLE_RATE', os.environ.get('PROFILE_SAMPLE_RATE', 0)))
+    gevent_serving = app.config.get('SERVING_MODE', os.environ.get('SERVING_MODE')) == 'gevent' or is_gevent_patched()
+    profiler = app.config.get('PROFILER', os.environ.get('PROFILER', 'sampling' if gevent_serving else 'cprofile'))
+    if profiler not in PROFILERS:
+        raise ValueError(f"unknown profiler '{profiler}', use one of {', '.join(PROFILERS)}")
+    if profiler == 'cprofile' and gevent_serving and (profile_token or profile_sample_rate):
+        raise ValueError("PROFILER='cprofile' can't profile a single request under gevent, use 'sampling'")
+    profile_store.resize(app.config.get('PROFILE_BUFFER_SIZE', PROFILE_BUFFER_SIZE))
+    request_profiler.sampler.interval = app.config.get('PROFILE_SAMPLE_INTERVAL', PROFILE_SAMPLE_INTERVAL)
+    # Serving the listings and the quizzes from the memory mapped snapshot of QUESTION_SNAPSHOT_PATH (shared by the
+    # worker processes) when it is set, the snapshot is rebuilt after the writes and the database is read meanwhile
+    snapshot_store.rebuild_delay = app.config.get('QUESTION_SNAPSHOT_REBUILD_DELAY', SNAPSHOT_REBUILD_DELAY)
+    snapshot_store.configure(app, app.config.get('QUESTION_SNAPSHOT_PATH', os.environ.get('QUESTION_SNAPSHOT_PATH')))
 
     # Setting up the cors
     CORS(app, resources={r"/*": {"origins": "*"}})
@@ -24,45 +103,191 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Methods', 'GET,POST,DELETE,OPTIONS')
         return response
 
+    # Profiling the chosen requests, the hooks are not registered at all when profiling is off
+    if profile_token or profile_sample_rate:
+        @app.before_request
+        def start_profile():
+            trigger = should_profile(request.headers.get(PROFILE_HEADER), profile_token, profile_sample_rate)
+            if trigger is not None:
+                request_profiler.start(profiler, trigger)
+
+        @app.after_request
+        def finish_profile(response):
+            profile_id = request_profiler.finish(request.method, request.path, request.endpoint,
+                                                 response.status_code)
+            if profile_id is not None:
+                response.headers['X-Profile-Id'] = str(profile_id)
+            return response
+
+        @app.teardown_request
+        def discard_profile(error):
+            request_profiler.discard()
+
+    # Compressing the JSON responses with gzip (or brotli when it is installed) for the clients accepting it, the
+    # responses under COMPRESSION_MIN_SIZE bytes are sent as they are. COMPRESSION_ENABLED=False turns it off
+    if app.config.get('COMPRESSION_ENABLED', True):
+        @app.after_request
+        def compress(response):
+            return compress_response(response, request.accept_encodings,
+                                     app.config.get('COMPRESSION_MIN_SIZE', COMPRESSION_MIN_SIZE))
+
+    # Sending the reads of the read only requests to the replicas (when SQLALCHEMY_REPLICA_URIS is set)
+    @app.before_request
+    def route_reads():
+        read_from_replicas(request.method == 'GET' or request.endpoint in READ_ONLY_POST_ENDPOINTS)
+
+    # Measuring the latency and the SQL statements of every request, METRICS_ENABLED=False turns it off
+    if app.config.get('METRICS_ENABLED', True):
+        request_metrics.enable_sql_timing()
+
+        @app.before_request
+        def start_request_metrics():
+            request_metrics.start_request()
+
+        @app.after_request
+        def finish_request_metrics(response):
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            measures = request_metrics.finish_request(route, request.method, response.status_code)
+            if measures:
+                response.headers['Server-Timing'] = server_timing_header(*measures)
+                response.headers['Timing-Allow-Origin'] = '*'
+            return response
+
+        @app.route('/metrics', methods=['GET'])
+        def get_metrics():
+            pool_status = get_pool_status(db.engine.pool)
+            gauges = [
+                ('trivia_db_pool_checked_out', "The number of connections in use", pool_status.get('checked_out', 0)),
+                ('trivia_db_pool_overflow', "The number of overflow connections", pool_status.get('overflow', 0)),
+                ('trivia_db_pool_timeouts', "The number of checkouts that timed out", pool_status['timeouts'])
+            ]
+            return Response(request_metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+    # Admitting the request or refusing it with a 429 (the client is over its rate) or a 503 (the route or the worker is
+    # too busy for the route priority), the refused requests are still measured by the metrics
+    if admission_controller is not None:
+        @app.before_request
+        def admit_request():
+            refusal = admission_controller.admit(request.endpoint, request.remote_addr or '')
+            if refusal is not None:
+                status, message, retry_after = refusal
+                return jsonify({
+                    'success': False,
+                    'error': status,
+                    'message': message
+                }), status, {'Retry-After': str(retry_after)}
+            g.admitted = True
+
+        @app.teardown_request
+        def release_request(error):
+            if g.pop('admitted', False):
+                admission_controller.release(request.endpoint)
   
     @app.route('/categories', methods=['GET'])
     def get_categories():
-        categories = None
+        categories_map = None
         try:
-            categories = Category.query.order_by('id').all()
+            categories_map = category_cache.get_map()
         except():
             abort(500)
-        if not categories:
+        if not categories_map:
             abort(404)
-        categories_map = get_all_categories_map(categories)
-        return jsonify({
+        response = jsonify({
             'categories': categories_map
-        }), 200
+        })
+        # Letting browsers and CDNs revalidate the categories and get a 304 instead of downloading them again
+        response.set_etag(category_cache.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config.get('CATEGORIES_MAX_AGE', CATEGORIES_MAX_AGE)
+        return response.make_conditional(request)
 
     
     @app.route('/questions', methods=['GET'])
+    @cached_listing
     def get_questions():
-        # Getting the questions and the categories
-        all_questions = None
-        categories = None
+        # Fetching the requested questions only when an 'ids' param is given (ex: ?ids=1,2,3)
+        if 'ids' in request.args:
+            return get_questions_by_ids(request.args['ids'])
+        # Getting the questions in the requested page and the categories, the page is fetched by the database
+        serialized_questions = None
+        next_cursor = None
+        total_questions = None
+        categories_map = None
+        snapshot = snapshot_store.current()
         try:
-            all_questions = Question.query.order_by('id').all()
-            categories = Category.query.order_by('id').all()
+            if snapshot is not None:
+                serialized_questions, next_cursor = snapshot.page(QUESTIONS_PER_PAGE,
+                                                                  request.args.get('page', 1, type=int),
+                                                                  request.args.get('cursor', None, type=int))
+                total_questions = snapshot.size
+                categories_map = snapshot.categories_map()
+            else:
+                serialized_questions, next_cursor = get_paginated_data(request, query_question_rows(), Question.id,
+                                                                       QUESTIONS_PER_PAGE, format_question_row)
+                total_questions = question_counters.total()
+                categories_map = category_cache.get_map()
         except():
             abort(500)
-        # Serializing the questions and shuffling them
-        serialized_questions = get_paginated_data(request, all_questions, QUESTIONS_PER_PAGE)
-        if not serialized_questions or not categories:
+        # Returning 404 for an empty page then shuffling the questions of the page, the same 'seed' param gives the
+        # same shuffle so the response can be cached
+        if not serialized_questions or not categories_map:
             abort(404)
-        random.shuffle(serialized_questions)
-        categories_map = get_all_categories_map(categories)
+        rng = random.Random(request.args.get('seed', None, type=int))
+        rng.shuffle(serialized_questions)
         # Getting a random number that will represent the current category
-        current_category = random.randrange(LENGTH_CATEGORIES) + 1
+        current_category = rng.randrange(LENGTH_CATEGORIES) + 1
         return jsonify({
             'questions': serialized_questions,
-            'total_questions': len(all_questions),
+            'total_questions': total_questions,
             'categories': categories_map,
-            'current_category': current_category
+            'current_category': current_category,
+            'next_cursor': next_cursor
+        }), 200
+
+    
+    def get_questions_by_ids(ids_param):
+        # Parsing the comma separated ids
+        question_ids = None
+        try:
+            question_ids = parse_question_ids(ids_param.split(','))
+        except ValueError:
+            abort(422)
+        # Fetching all the questions with a single query, the ids that don't exist are reported as not found
+        questions_by_id = fetch_questions(question_ids)
+        if not questions_by_id:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'questions': [questions_by_id[question_id] for question_id in question_ids
+                          if question_id in questions_by_id],
+            'not_found_ids': [question_id for question_id in question_ids if question_id not in questions_by_id]
+        }), 200
+
+    
+    @app.route('/questions', methods=['DELETE'])
+    def delete_questions_in_batch():
+        # Getting the request data as JSON
+        req_body = request.get_json()
+        if req_body is None:
+            abort(400)
+        # Checking the validity of the request body, it holds the list of the ids to delete
+        question_ids = None
+        try:
+            question_ids = parse_question_ids(req_body['ids'])
+        except (KeyError, TypeError, ValueError):
+            abort(422)
+        # Deleting all the questions in a single transaction
+        deleted = None
+        try:
+            deleted = delete_questions(question_ids)
+        except SQLAlchemyError:
+            abort(500)
+        return jsonify({
+            'success': True,
+            'results': [{'id': question_id, 'status': 'deleted' if question_id in deleted else 'not_found'}
+                        for question_id in question_ids],
+            'deleted_count': len(deleted),
+            'total_questions': question_counters.total()
         }), 200
 
     
@@ -84,7 +309,7 @@ def create_app(test_config=None):
         return jsonify({
             'success': True,
             'deleted_question_id': question_to_delete.id,
-            'total_questions': len(Question.query.order_by('id').all())
+            'total_questions': question_counters.total()
         }), 200
 
     
@@ -99,14 +324,30 @@ def create_app(test_config=None):
         for field in req_body:
             if field not in allowed_fields_of_question:
                 abort(422)
-        # Checking if difficulty is a number
+        # Checking if difficulty and category are numbers and if the category exists
         difficulty = None
+        category = None
         try:
             difficulty = int(req_body['difficulty'])
-        except():
+            category = int(req_body['category'])
+        except (KeyError, TypeError, ValueError):
             abort(422)
+        if str(category) not in category_cache.get_map() or not isinstance(req_body.get('question'), str):
+            abort(422)
+        # Looking for the questions this one duplicates (same text or nearly), they are refused with 409 when
+        # DUPLICATE_POLICY is 'reject' and reported in the response when it is 'warn'
+        duplicates = []
+        if duplicate_policy != 'off':
+            duplicates = duplicate_index.find(req_body['question'])
+        if duplicates and duplicate_policy == 'reject':
+            return jsonify({
+                'success': False,
+                'error': 409,
+                'message': "the question duplicates existing questions",
+                'duplicates': duplicates
+            }), 409
         # Adding the question to the database
-        question = Question(req_body['question'], req_body['answer'], req_body['category'], difficulty)
+        question = Question(req_body['question'], req_body['answer'], category, difficulty)
         operation_success = question.insert()
         if not operation_success:
             abort(500)
@@ -114,9 +355,45 @@ def create_app(test_config=None):
         return jsonify({
             'success': True,
             'question_id': question.id,
-            'total_questions': len(Question.query.order_by('id').all())
+            'total_questions': question_counters.total(),
+            'duplicates': duplicates
+        }), 201
+
+
+    @app.route('/questions/bulk', methods=['POST'])
+    def add_questions_in_bulk():
+        # Getting the categories to validate the rows against
+        categories_map = None
+        try:
+            categories_map = category_cache.get_map()
+        except():
+            abort(500)
+        # Streaming the rows from the request body and inserting them in chunks
+        atomic = request.args.get('atomic', 'false').lower() in ('1', 'true')
+        rows = iter_request_rows(request.stream, request.mimetype)
+        inserted, failed, errors = import_questions(rows, categories_map, atomic=atomic)
+        # Nothing could be inserted, returning the reasons with the 422 error
+        if failed and not inserted:
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': "please provide valid fields in your request body",
+                'failed': failed,
+                'errors': errors
+            }), 422
+        return jsonify({
+            'success': True,
+            'inserted': inserted,
+            'failed': failed,
+            'errors': errors,
+            'total_questions': question_counters.total()
         }), 201
 
+    @app.route('/questions/export', methods=['GET'])
+    def export_all_questions():
+        # Streaming the questions as NDJSON, one question per line
+        return Response(stream_with_context(export_questions()), mimetype='application/x-ndjson')
+
    
     @app.route('/questions/search', methods=['POST'])
     def search_questions():
@@ -130,11 +407,18 @@ def create_app(test_config=None):
             search_term = req_body['searchTerm']
         else:
             abort(422)
-        if not search_term:
+        if not search_term or not isinstance(search_term, str):
             abort(422)
+        include_answers = bool(req_body.get('includeAnswers', False))
+        # Getting the page passes as params in the url
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            abort(404)
         questions = None
+        total_questions = None
         try:
-            questions = Question.query.filter(Question.question.ilike(f'%{search_term}%')).all()
+            questions, total_questions = search_questions_index(search_term, include_answers,
+                                                                (page - 1) * QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE)
         except():
             abort(500)
         # Returning a response if no data is found
@@ -146,34 +430,65 @@ def create_app(test_config=None):
                     'current_category': None
                 }
             ), 404
-        questions_serialized = [question.format() for question in questions]
+        questions_serialized = [format_question_row(question) for question in questions]
         # Getting a random number that will represent the current category
         current_category = random.randrange(LENGTH_CATEGORIES) + 1
         return jsonify(
             {
                 'questions': questions_serialized,
-                'total_questions': len(questions_serialized),
+                'total_questions': total_questions,
                 'current_category': current_category
             }
         ), 200
 
    
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @cached_listing
     def get_questions_by_category(category_id):
-        # Getting questions in the given category
-        questions_in_category = None
+        # Getting the number of questions in the given category, from the snapshot when it is up to date
+        total_questions = None
+        snapshot = snapshot_store.current()
+        try:
+            if snapshot is not None:
+                total_questions = snapshot.count(category_id)
+            else:
+                total_questions = question_counters.in_category(category_id)
+        except():
+            abort(500)
+        # The same 'seed' param gives the same shuffle
+        rng = random.Random(request.args.get('seed', None, type=int))
+        # Streaming the large categories: the questions are read with a server side cursor and sent chunk by chunk,
+        # each chunk is shuffled on its own
+        if total_questions > app.config.get('LISTING_STREAM_THRESHOLD', LISTING_STREAM_THRESHOLD):
+            if snapshot is not None:
+                questions_in_category_serialized = snapshot.iter_category(category_id)
+            else:
+                questions_in_category_serialized = (
+                    format_question_row(question) for question in
+                    query_question_rows().filter(Question.category == category_id).order_by(Question.id)
+                    .yield_per(LISTING_STREAM_CHUNK_SIZE))
+            return stream_jsonify({
+                'questions': shuffle_in_chunks(questions_in_category_serialized, rng, LISTING_STREAM_CHUNK_SIZE),
+                'total_questions': total_questions,
+                'current_category': category_id,
+            }, 'questions'), 200
+        # Getting the serialized questions in the given category
+        questions_in_category_serialized = None
         try:
-            questions_in_category = Question.query.filter(Question.category == category_id).all()
+            if snapshot is not None:
+                questions_in_category_serialized = snapshot.in_category(category_id)
+            else:
+                questions_in_category_serialized = [format_question_row(question) for question in
+                                                    query_question_rows().filter(Question.category == category_id)]
         except():
             abort(500)
-        if not questions_in_category:
+        if not questions_in_category_serialized:
             abort(404)
-        # Serializing and shuffling the questions then returning them
-        questions_in_category_serialized = [question.format() for question in questions_in_category]
-        random.shuffle(questions_in_category_serialized)
+        # Shuffling the questions then returning them
+        rng.shuffle(questions_in_category_serialized)
         return jsonify({
             'questions': questions_in_category_serialized,
-            'total_questions': len(questions_in_category_serialized),
+            'total_questions': total_questions,
             'current_category': category_id,
         }), 200
 
@@ -185,7 +500,7 @@ def create_app(test_config=None):
         if req_body is None:
             abort(400)
         # Checking the validity of the request body
-        allowed_fields = ['quiz_category', 'previous_questions']
+        allowed_fields = ['quiz_category', 'previous_questions', 'difficulty', 'last_answer_correct']
         for field in req_body:
             if field not in allowed_fields:
                 abort(422)
@@ -197,20 +512,169 @@ def create_app(test_config=None):
             previous_questions_ids = list(req_body['previous_questions'])
         except ValueError:
             abort(422)
+        # Getting the difficulties to pick from: the requested 'difficulty' (or the one after it on the adaptive curve
+        # when 'last_answer_correct' is given) then the closest ones, any difficulty if none is requested
+        target_difficulty = None
+        difficulties = None
+        if req_body.get('difficulty') is not None:
+            last_answer_correct = req_body.get('last_answer_correct')
+            try:
+                if last_answer_correct is not None and not isinstance(last_answer_correct, bool):
+                    raise ValueError("last_answer_correct must be a boolean")
+                target_difficulty = get_target_difficulty(req_body['difficulty'], last_answer_correct)
+            except ValueError:
+                abort(422)
+            difficulties = get_difficulty_order(target_difficulty, prefer_harder=bool(last_answer_correct))
         # Getting the next question to send, that question's id is not in the 'previous_questions_ids' list and its
         # category matches the 'quiz_category'
-        questions_in_the_quiz_category = None
+        next_question_serialized = None
+        total_questions = None
+        snapshot = snapshot_store.current()
         try:
-            if quiz_category == 0:
-                questions_in_the_quiz_category = Question.query.all()
+            if snapshot is not None:
+                next_question_serialized = snapshot.get_next_question(previous_questions_ids, quiz_category,
+                                                                      difficulties)
+                total_questions = snapshot.count(quiz_category)
             else:
-                questions_in_the_quiz_category = Question.query.filter(Question.category == quiz_category).all()
+                next_question_serialized = get_next_question(previous_questions_ids, quiz_category, question_index,
+                                                             difficulties)
+                total_questions = question_counters.in_category(quiz_category)
+        except():
+            abort(500)
+        return jsonify({
+            'total_questions': total_questions,
+            'question': next_question_serialized,
+            'target_difficulty': target_difficulty
+        }), 200
+
+    @app.route('/quizzes/results', methods=['POST'])
+    def record_quiz_results():
+        # Getting the request data as JSON
+        req_body = request.get_json()
+        if req_body is None:
+            abort(400)
+        # Checking the validity of the answers
+        answers = None
+        try:
+            answers = parse_answers(req_body.get('answers'))
+        except (AttributeError, TypeError, ValueError):
+            abort(422)
+        # Buffering the answers, they are written in the background. A full buffer means the database can't keep up,
+        # the client is told to retry later
+        if not results_buffer.put(answers):
+            return jsonify({
+                'success': False,
+                'error': 503,
+                'message': "too many quiz results, retry later"
+            }), 503, {'Retry-After': str(max(1, math.ceil(results_buffer.flush_interval)))}
+        return jsonify({
+            'success': True,
+            'accepted': len(answers)
+        }), 202
+
+    @app.route('/questions/<int:question_id>/stats', methods=['GET'])
+    def get_question_stats_by_id(question_id):
+        # Getting the question to know its category
+        question = query_question_rows().filter(Question.id == question_id).first()
+        if question is None:
+            abort(404)
+        stats = get_question_stats(question_id, question.category)
+        stats['success'] = True
+        stats['question_id'] = question_id
+        return jsonify(stats), 200
+
+    @app.route('/admin/results', methods=['GET'])
+    def get_results_buffer_stats():
+        return jsonify({
+            'results': results_buffer.stats()
+        }), 200
+
+    @app.route('/admin/cache', methods=['GET'])
+    def get_cache_stats():
+        return jsonify({
+            'categories': category_cache.stats(),
+            'responses': response_cache.stats(),
+            'snapshot': snapshot_store.stats()
+        }), 200
+
+    def require_profile_token():
+        # The profiles show the code and the data of the requests, they are only served to the requests carrying the
+        # PROFILE_TOKEN, and the routes don't exist (404) when no token is set or the header doesn't match
+        if not has_profile_token(request.headers.get(PROFILE_HEADER), profile_token):
+            abort(404)
+
+    @app.route('/admin/profiles', methods=['GET'])
+    def get_profiles():
+        require_profile_token()
+        return jsonify({
+            'profiles': profile_store.summaries()
+        }), 200
+
+    @app.route('/admin/profiles/<int:profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        require_profile_token()
+        # Getting the profile, it is dropped from the ring buffer once PROFILE_BUFFER_SIZE newer profiles came in
+        profile = profile_store.get(profile_id)
+        if profile is None:
+            abort(404)
+        # Rendering it as a pstats table (cProfile) or as collapsed stacks for the flamegraph tools (sampling)
+        profile_text = None
+        try:
+            profile_text = render_profile(profile, request.args.get('format', PROFILE_FORMATS[profile['profiler']]))
+        except ValueError:
+            abort(422)
+        return Response(profile_text, mimetype='text/plain')
+
+    @app.route('/admin/admission', methods=['GET'])
+    def get_admission_stats():
+        return jsonify({
+            'admission': admission_controller.stats() if admission_controller is not None else None
+        }), 200
+
+    @app.route('/admin/pool', methods=['GET'])
+    def get_pool_stats():
+        return jsonify({
+            'pool': get_pool_status(db.engine.pool),
+            'replicas': replica_router.status()
+        }), 200
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        # Getting the request data as JSON
+        req_body = request.get_json()
+        if req_body is None:
+            abort(400)
+        # Parsing the request to make sure the request body is correctly formatted
+        quiz_category = None
+        try:
+            quiz_category = int(req_body['quiz_category']['id'])
+        except (KeyError, TypeError, ValueError):
+            abort(422)
+        # Dealing a shuffled deck of the questions in the category to the new session
+        session_id = None
+        total_questions = None
+        try:
+            session_id, total_questions = quiz_sessions.create(quiz_category)
         except():
             abort(500)
-        next_question_serialized = get_next_question(previous_questions_ids, questions_in_the_quiz_category)
         return jsonify({
-            'total_questions': len(questions_in_the_quiz_category),
-            'question': next_question_serialized
+            'success': True,
+            'session_id': session_id,
+            'total_questions': total_questions
+        }), 201
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_session_question(session_id):
+        # Popping the next question of the session deck, the session doesn't exist or expired if it is not found
+        next_question_serialized = None
+        remaining_questions = None
+        try:
+            next_question_serialized, remaining_questions = quiz_sessions.next_question(session_id)
+        except KeyError:
+            abort(404)
+        return jsonify({
+            'question': next_question_serialized,
+            'remaining_questions': remaining_questions
         }), 200
    
     # Error handler Routes:
@@ -247,4 +711,40 @@ def create_app(test_config=None):
             'message': "server error"
         }), 500
 
+    # Creating the tables and applying the migrations with 'flask init-db', the app itself doesn't touch the schema
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the missing tables and apply the SQL migrations."""
+        for name in init_db():
+            click.echo(f"Applied {name}")
+        click.echo("The database is ready")
+
+    # Building the questions snapshot of QUESTION_SNAPSHOT_PATH with 'flask build-snapshot', the running workers swap
+    # to it on their next read
+    @app.cli.command('build-snapshot')
+    def build_snapshot_command():
+        """Build the memory mapped questions snapshot."""
+        if snapshot_store.path is None:
+            raise click.UsageError("QUESTION_SNAPSHOT_PATH is not set")
+        click.echo(f"{snapshot_store.rebuild()} questions written to {snapshot_store.path}")
+
+    # Printing the groups of duplicated questions of the whole bank with 'flask dedupe-report', one JSON line per group
+    @app.cli.command('dedupe-report')
+    def dedupe_report_command():
+        """Print the groups of duplicated questions."""
+        groups = duplicate_index.groups()
+        for group in groups:
+            questions = query_question_rows().filter(Question.id.in_(group)).order_by(Question.id).all()
+            click.echo(json.dumps({'ids': group, 'questions': [question.question for question in questions]}))
+        click.echo(f"{len(groups)} groups of duplicated questions", err=True)
+
+    # Loading the caches before the first request when PRELOAD_CACHES is true in the app config or the environment
+    preload_durations = {}
+    if is_enabled(app.config, 'PRELOAD_CACHES'):
+        with app.app_context():
+            preload_durations = preload_caches()
+    app.logger.info("The app started in %.1f ms%s", (time.perf_counter() - started_at) * 1000,
+                    ''.join(f", {name} preloaded in {duration * 1000:.1f} ms"
+                            for name, duration in preload_durations.items()))
+
     return app
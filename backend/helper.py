@@ -1,27 +1,92 @@
-import random
+from models import db, Question
+from question_index import MIN_DIFFICULTY, MAX_DIFFICULTY
 
+# The columns of a question, queried as plain tuples to skip building Question objects (see format_question_row)
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
 
-def get_paginated_data(req, all_data, step):
+
+def query_question_rows():
+    """
+    A function that returns a query of the questions columns, the query returns tuples instead of Question objects so
+    the rows are not added to the session identity map nor instrumented
+    :return: the query of the QUESTION_COLUMNS
+    """
+    return db.session.query(*QUESTION_COLUMNS)
+
+
+def format_question_row(row):
+    """
+    A function that serializes a row of the QUESTION_COLUMNS like Question.format() does
+    :param row: a tuple of id, question, answer, category, difficulty
+    :return: the serialized question
     """
-    A function that returns a specific chunk of a query data
+    question_id, question, answer, category, difficulty = row
+    return {
+        'id': question_id,
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty
+    }
+
+
+def get_paginated_data(req, query, id_column, step, format_item=None):
+    """
+    A function that returns a specific chunk of a query data, the chunk is fetched by the database (LIMIT/OFFSET or
+    'id > cursor' when a cursor is given) so only the rows of the page are loaded
     :param req: the request object offered by flask
-    :param all_data: the query returned from getting all the data in a database
+    :param query: the query of the data to paginate (not executed yet)
+    :param id_column: the primary key column used to order the data and to build the cursor
     :param step: the step of your pagination
-    :return: the serialized data in a specific page (the page is in the req object as a params)
+    :param format_item: the function serializing an item of the query, item.format() if it is not given
+    :return: a tuple of the serialized data in a specific page (the page or the cursor is in the req object as params)
+     and the cursor of the next page (None if there is no next page)
     """
 
-    # Getting the page passes as params in the url
+    # Getting the page or the cursor passed as params in the url, the cursor is the id of the last item seen
+    cursor = req.args.get('cursor', None, type=int)
     page = req.args.get('page', 1, type=int)
-    # Forming the start and the end of data to send
-    start = (page - 1) * step
-    end = start + step
-    # Getting the raw data to send
-    items_in_page = all_data[start: end]
+    query = query.order_by(id_column)
+    if cursor is not None:
+        query = query.filter(id_column > cursor)
+    elif page > 0:
+        query = query.offset((page - 1) * step)
+    else:
+        return None, None
+    # Getting one more item than the step to know if there is a next page without counting
+    items_in_page = query.limit(step + 1).all()
+    next_cursor = None
+    if len(items_in_page) > step:
+        items_in_page = items_in_page[:step]
+        next_cursor = items_in_page[-1].id
     # Serializing the data if it exists
     items_in_page_serialized = None
     if items_in_page:
-        items_in_page_serialized = [item.format() for item in items_in_page]
-    return items_in_page_serialized
+        if format_item is None:
+            items_in_page_serialized = [item.format() for item in items_in_page]
+        else:
+            items_in_page_serialized = [format_item(item) for item in items_in_page]
+    return items_in_page_serialized, next_cursor
+
+
+def shuffle_in_chunks(items, rng, chunk_size):
+    """
+    A function that shuffles a stream of items chunk by chunk, each chunk of 'chunk_size' items is shuffled and yielded
+    before the next one is read so the stream is never held in memory. An item only moves inside its chunk
+    :param items: an iterable of the items
+    :param rng: the random.Random shuffling the chunks
+    :param chunk_size: the number of items shuffled together
+    :return: a generator of the shuffled items
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            rng.shuffle(chunk)
+            yield from chunk
+            chunk = []
+    rng.shuffle(chunk)
+    yield from chunk
 
 
 def get_all_categories_map(categories_query):
@@ -36,19 +101,56 @@ def get_all_categories_map(categories_query):
     return categories_map
 
 
-def get_next_question(previous_questions_ids, questions_in_the_quiz_category):
+def get_target_difficulty(difficulty, last_answer_correct=None):
+    """
+    A function that returns the difficulty of the next quiz question, the adaptive curve goes one level up after a
+    correct answer and one level down after a wrong one
+    :param difficulty: the requested difficulty, or the difficulty of the previous question when adapting
+    :param last_answer_correct: whether the previous question was answered correctly, None to keep 'difficulty'
+    :return: the target difficulty between MIN_DIFFICULTY and MAX_DIFFICULTY, raises ValueError if 'difficulty' is
+     invalid
+    """
+    if isinstance(difficulty, bool) or not isinstance(difficulty, int):
+        raise ValueError("the difficulty must be an int")
+    if not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+        raise ValueError(f"the difficulty must be between {MIN_DIFFICULTY} and {MAX_DIFFICULTY}")
+    if last_answer_correct is not None:
+        difficulty += 1 if last_answer_correct else -1
+    return min(max(difficulty, MIN_DIFFICULTY), MAX_DIFFICULTY)
+
+
+def get_difficulty_order(target, prefer_harder=False):
     """
-    A function that returns the next question that is in
-     'questions_in_the_quiz_category' and not in 'previous_questions_ids'
+    A function that returns the difficulties from the closest to 'target' to the farthest, used to fall back to the
+    closest difficulty when all the questions of the target difficulty were asked
+    :param target: the target difficulty
+    :param prefer_harder: whether the harder difficulty comes first between two equally close ones
+    :return: a list of all the difficulties
+    """
+    return sorted(range(MIN_DIFFICULTY, MAX_DIFFICULTY + 1),
+                  key=lambda difficulty: (abs(difficulty - target), (difficulty < target) == prefer_harder))
+
+
+def get_next_question(previous_questions_ids, quiz_category, index, difficulties=None):
+    """
+    A function that returns a random question that is in the category 'quiz_category' and not in
+     'previous_questions_ids', the question id is picked from the in-memory index so the category is not loaded
     :param previous_questions_ids: a list of previous questions ids
-    :param questions_in_the_quiz_category: a query containing all the questions in a given category
-    :return: a serialized question in 'questions_in_the_quiz_category and not in 'previous_questions_ids'
-    """
-    # Shuffling the array to get different question every game
-    random.shuffle(questions_in_the_quiz_category)
-    # Getting a question from the shuffled array
-    for question in questions_in_the_quiz_category:
-        if question.id not in previous_questions_ids:
-            return question.format()
+    :param quiz_category: the category id of the quiz, 0 for all the categories
+    :param index: the QuestionIndex holding the questions ids per category and difficulty
+    :param difficulties: the difficulties to pick the question from, the first one that still has questions is used,
+     None for any difficulty
+    :return: a serialized question in 'quiz_category' and not in 'previous_questions_ids'
+    """
+    excluded_ids = set(previous_questions_ids)
+    for difficulty in difficulties or [None]:
+        question_id = index.sample(quiz_category, excluded_ids, difficulty)
+        while question_id is not None:
+            question = query_question_rows().filter(Question.id == question_id).first()
+            if question is not None:
+                return format_question_row(question)
+            # The question was deleted by another process, dropping it from the index and picking another one
+            index.remove(question_id)
+            question_id = index.sample(quiz_category, excluded_ids, difficulty)
     # No question was found (all questions in that category has been already displayed)
     return None
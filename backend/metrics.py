@@ -0,0 +1,155 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# The upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# The upper bounds of the histogram of SQL statements per request
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    """
+    A cumulative histogram in the Prometheus format (a count per upper bound, the sum and the count)
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RequestMetrics:
+    """
+    The per route latency and SQL statements of the requests, the SQL statements are counted and timed by SQLAlchemy
+    cursor events for the thread serving the request
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sql_timing_enabled = False
+        self._latencies = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))
+        self._sql_durations = defaultdict(float)
+        self._responses = defaultdict(int)
+
+    def enable_sql_timing(self):
+        """
+        A function that starts listening to the SQL statements of every engine, it is called once
+        """
+        with self._lock:
+            if self._sql_timing_enabled:
+                return
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            self._sql_timing_enabled = True
+
+    def start_request(self):
+        """
+        A function that starts measuring the request served by the current thread
+        """
+        local = self._local
+        local.active = True
+        local.statements = 0
+        local.sql_duration = 0.0
+        local.started_at = time.perf_counter()
+
+    def finish_request(self, route, method, status):
+        """
+        A function that records the request served by the current thread
+        :param route: the url rule of the request
+        :param method: the http method of the request
+        :param status: the status code of the response
+        :return: a tuple of the request duration, the number of SQL statements and their duration (in seconds)
+        """
+        local = self._local
+        if not getattr(local, 'active', False):
+            return None
+        local.active = False
+        duration = time.perf_counter() - local.started_at
+        key = (route, method)
+        with self._lock:
+            self._latencies[key].observe(duration)
+            self._statements[key].observe(local.statements)
+            self._sql_durations[key] += local.sql_duration
+            self._responses[(route, method, status)] += 1
+        return duration, local.statements, local.sql_duration
+
+    def render(self, gauges=()):
+        """
+        A function that returns the metrics in the Prometheus text format
+        :param gauges: extra (name, help, value) tuples to export
+        :return: the metrics as text
+        """
+        lines = []
+        with self._lock:
+            lines.append('# HELP trivia_http_requests_total The number of responses per route, method and status')
+            lines.append('# TYPE trivia_http_requests_total counter')
+            for (route, method, status), count in sorted(self._responses.items()):
+                lines.append(f'trivia_http_requests_total{{route="{route}",method="{method}",status="{status}"}} '
+                             f'{count}')
+            lines.append('# HELP trivia_http_request_duration_seconds The latency of the requests per route')
+            lines.append('# TYPE trivia_http_request_duration_seconds histogram')
+            for (route, method), histogram in sorted(self._latencies.items()):
+                lines.extend(histogram.render('trivia_http_request_duration_seconds',
+                                              f'route="{route}",method="{method}"'))
+            lines.append('# HELP trivia_sql_statements_per_request The number of SQL statements per request')
+            lines.append('# TYPE trivia_sql_statements_per_request histogram')
+            for (route, method), histogram in sorted(self._statements.items()):
+                lines.extend(histogram.render('trivia_sql_statements_per_request',
+                                              f'route="{route}",method="{method}"'))
+            lines.append('# HELP trivia_sql_duration_seconds_total The time spent executing SQL statements per route')
+            lines.append('# TYPE trivia_sql_duration_seconds_total counter')
+            for (route, method), duration in sorted(self._sql_durations.items()):
+                lines.append(f'trivia_sql_duration_seconds_total{{route="{route}",method="{method}"}} {duration}')
+        for name, description, value in gauges:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, 'active', False):
+            conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        local = self._local
+        if getattr(local, 'active', False) and conn.info.get('query_start_time'):
+            local.statements += 1
+            local.sql_duration += time.perf_counter() - conn.info['query_start_time'].pop()
+
+
+request_metrics = RequestMetrics()
+
+
+def server_timing_header(duration, statements, sql_duration):
+    """
+    A function that returns the value of the Server-Timing header of a request
+    :param duration: the duration of the request in seconds
+    :param statements: the number of SQL statements executed by the request
+    :param sql_duration: the time spent executing them in seconds
+    :return: the header value
+    """
+    return f'app;dur={duration * 1000:.2f}, db;dur={sql_duration * 1000:.2f};desc="{statements} queries"'
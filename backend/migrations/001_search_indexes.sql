@@ -0,0 +1,9 @@
+-- Full text search indexes for POST /questions/search (see search.PostgresSearch)
+-- The indexed expressions must stay identical to the ones built by the search queries.
+-- Run with: psql trivia < migrations/001_search_indexes.sql
+
+CREATE INDEX IF NOT EXISTS ix_questions_question_tsv
+    ON questions USING GIN (to_tsvector('simple'::regconfig, question));
+
+CREATE INDEX IF NOT EXISTS ix_questions_question_answer_tsv
+    ON questions USING GIN (to_tsvector('simple'::regconfig, question || ' ' || answer));
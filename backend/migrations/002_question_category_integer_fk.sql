@@ -0,0 +1,21 @@
+-- Makes questions.category an indexed integer foreign key to categories.id (see models.Question)
+-- Works on a database restored from trivia.psql as well as one created by db.create_all() with a text category.
+-- Run with: psql trivia < migrations/002_question_category_integer_fk.sql
+
+BEGIN;
+
+ALTER TABLE questions ALTER COLUMN category TYPE integer USING category::integer;
+ALTER TABLE questions ALTER COLUMN category SET NOT NULL;
+
+-- trivia.psql names its foreign key 'category', replacing it with the one declared by the model
+ALTER TABLE questions DROP CONSTRAINT IF EXISTS category;
+ALTER TABLE questions DROP CONSTRAINT IF EXISTS questions_category_fkey;
+ALTER TABLE questions ADD CONSTRAINT questions_category_fkey
+    FOREIGN KEY (category) REFERENCES categories (id) ON UPDATE CASCADE;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON questions (category, id);
+CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON questions (difficulty);
+
+COMMIT;
+
+ANALYZE questions;
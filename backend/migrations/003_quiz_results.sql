@@ -0,0 +1,26 @@
+-- Tables of the quiz results written by the results buffer and of their per question and per category aggregates
+-- (see results.py and models.QuizResult, models.QuestionStats, models.CategoryStats)
+-- Run with: psql trivia < migrations/003_quiz_results.sql
+
+CREATE TABLE IF NOT EXISTS quiz_results (
+    id serial PRIMARY KEY,
+    question_id integer NOT NULL,
+    category integer NOT NULL,
+    correct boolean NOT NULL,
+    answered_at timestamp without time zone NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS ix_quiz_results_question_id ON quiz_results (question_id);
+
+CREATE TABLE IF NOT EXISTS question_stats (
+    question_id integer PRIMARY KEY,
+    category integer NOT NULL,
+    plays integer NOT NULL DEFAULT 0,
+    correct integer NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS category_stats (
+    category integer PRIMARY KEY,
+    plays integer NOT NULL DEFAULT 0,
+    correct integer NOT NULL DEFAULT 0
+);
@@ -0,0 +1,18 @@
+-- Indexed content hash of the questions, POST /questions looks the exact duplicates up by it (see duplicates.py)
+-- The backfill computes the same md5 as duplicates.content_hash: the lowercased text with its punctuation replaced by
+-- spaces and its spaces collapsed. The app sets it on every insert and update.
+-- Run with: psql trivia < migrations/004_question_content_hash.sql
+
+BEGIN;
+
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS content_hash varchar(32);
+
+UPDATE questions
+SET content_hash = md5(btrim(regexp_replace(regexp_replace(lower(question), '[^\w\s]+', ' ', 'g'), '\s+', ' ', 'g')))
+WHERE content_hash IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_questions_content_hash ON questions (content_hash);
+
+COMMIT;
+
+ANALYZE questions;
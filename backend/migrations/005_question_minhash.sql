@@ -0,0 +1,10 @@
+-- Stored MinHash signature of the questions, the workers read it to build their index of near duplicates instead of
+-- hashing the whole bank at startup (see duplicates.py). It can't be computed in SQL: the app sets it on every insert
+-- and update, and the first worker catching up hashes the questions without one and stores their signature.
+-- Run with: psql trivia < migrations/005_question_minhash.sql
+
+BEGIN;
+
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS minhash bytea;
+
+COMMIT;
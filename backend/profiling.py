@@ -0,0 +1,302 @@
+import cProfile
+import hmac
+import io
+import itertools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# The request header asking for a profile of the request, its value must be the PROFILE_TOKEN of the app
+PROFILE_HEADER = 'X-Profile'
+# The profilers selectable with PROFILER: cProfile records every call, the sampling profiler records the stack of the
+# request thread every PROFILE_SAMPLE_INTERVAL seconds and costs much less
+PROFILERS = ('cprofile', 'sampling')
+# The number of profiles kept, the oldest one is dropped when a new one comes in
+PROFILE_BUFFER_SIZE = 50
+# The number of seconds between two samples of the sampling profiler
+PROFILE_SAMPLE_INTERVAL = 0.005
+# The number of functions printed in the pstats output
+PSTATS_LINES = 50
+# The output formats of a profile: the pstats table of the cProfile profiles and the collapsed stacks of the sampled
+# ones (the input of flamegraph.pl and speedscope)
+PROFILE_FORMATS = {'cprofile': 'pstats', 'sampling': 'collapsed'}
+
+
+def has_profile_token(header, token):
+    """
+    A function that checks the PROFILE_HEADER header of a request against the PROFILE_TOKEN of the app, in constant time
+    :param header: the value of the PROFILE_HEADER header of the request, None if it is missing
+    :param token: the PROFILE_TOKEN of the app, None when it is not set
+    :return: True if the header holds the token, False otherwise (always when no token is set)
+    """
+    return header is not None and bool(token) and hmac.compare_digest(header.encode('utf-8'), token.encode('utf-8'))
+
+
+def should_profile(header, token, sample_rate):
+    """
+    A function that chooses whether the current request is profiled
+    :param header: the value of the PROFILE_HEADER header of the request, None if it is missing
+    :param token: the PROFILE_TOKEN of the app, None to ignore the header
+    :param sample_rate: the fraction of the requests profiled at random
+    :return: 'header' or 'sample' when the request is profiled, None when it is not
+    """
+    if has_profile_token(header, token):
+        return 'header'
+    if sample_rate and random.random() < sample_rate:
+        return 'sample'
+    return None
+
+
+def is_gevent_patched():
+    """
+    A function that tells whether gevent patched the process (SERVING_MODE=gevent), the requests are then served by
+    greenlets sharing the OS threads
+    :return: True if the threading module is patched by gevent
+    """
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+class StackSampler:
+    """
+    A sampling profiler of the threads (or the greenlets under gevent) serving profiled requests, a single background
+    OS thread reads their stacks every 'interval' seconds and counts them. The thread runs only while a request is
+    profiled. Under gevent the sampler must be a real OS thread, a greenlet would only run while the request waits
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        """
+        :param interval: the number of seconds between two samples
+        """
+        self.interval = interval
+        # A lock of the OS threads, a gevent lock can't be shared with the sampler thread
+        self._lock = _native('_thread', 'allocate_lock')()
+        self._samples = {}
+        self._threads = {}
+        self._running = False
+
+    def start(self):
+        """
+        A function that starts sampling the current thread (or greenlet)
+        """
+        task, thread_id = _current_task()
+        with self._lock:
+            self._samples[task] = Counter()
+            self._threads[task] = thread_id
+            if not self._running:
+                self._running = True
+                _native('_thread', 'start_new_thread')(self._run, ())
+
+    def stop(self):
+        """
+        A function that stops sampling the current thread (or greenlet)
+        :return: a Counter of the number of samples of each collapsed stack
+        """
+        task, _ = _current_task()
+        with self._lock:
+            self._threads.pop(task, None)
+            return self._samples.pop(task, Counter())
+
+    def _run(self):
+        sleep = _native('time', 'sleep')
+        while True:
+            sleep(self.interval)
+            with self._lock:
+                if not self._samples:
+                    self._running = False
+                    return
+                tasks = list(self._threads.items())
+            frames = sys._current_frames()
+            stacks = {}
+            for task, thread_id in tasks:
+                # A greenlet that is switched out keeps its frame in gr_frame, the running one is the current frame of
+                # its thread
+                frame = getattr(task, 'gr_frame', None) or frames.get(thread_id)
+                if frame is not None:
+                    stacks[task] = _collapse(frame)
+            with self._lock:
+                for task, stack in stacks.items():
+                    if task in self._samples:
+                        self._samples[task][stack] += 1
+
+
+class ProfileStore:
+    """
+    A ring buffer of the last profiles, each profile has an id to fetch it with
+    """
+
+    def __init__(self, max_size=PROFILE_BUFFER_SIZE):
+        """
+        :param max_size: the number of profiles kept
+        """
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._profiles = deque(maxlen=max_size)
+
+    def resize(self, max_size):
+        """
+        A function that changes the number of profiles kept, the oldest profiles are dropped if there are too many
+        :param max_size: the number of profiles kept
+        """
+        with self._lock:
+            self._profiles = deque(self._profiles, maxlen=max_size)
+
+    def add(self, profile):
+        """
+        A function that stores a profile
+        :param profile: a dictionary of the request and the profiler data ('stats' or 'samples')
+        :return: the id of the profile
+        """
+        with self._lock:
+            profile['id'] = next(self._ids)
+            self._profiles.append(profile)
+            return profile['id']
+
+    def get(self, profile_id):
+        """
+        A function that returns a stored profile
+        :param profile_id: the id of the profile
+        :return: the profile, None if it was dropped or never existed
+        """
+        with self._lock:
+            for profile in self._profiles:
+                if profile['id'] == profile_id:
+                    return profile
+        return None
+
+    def summaries(self):
+        """
+        A function that returns the stored profiles without their profiler data
+        :return: a list of dictionaries of the profiles, the most recent first
+        """
+        with self._lock:
+            return [{key: value for key, value in profile.items() if key not in ('stats', 'samples')}
+                    for profile in reversed(self._profiles)]
+
+
+class RequestProfiler:
+    """
+    Profiles the requests served by the current thread with cProfile or the StackSampler, the profiles go to a
+    ProfileStore
+    """
+
+    def __init__(self, store, sampler):
+        """
+        :param store: the ProfileStore keeping the profiles
+        :param sampler: the StackSampler of the sampling profiles
+        """
+        self.store = store
+        self.sampler = sampler
+        self._local = threading.local()
+
+    def start(self, profiler, trigger):
+        """
+        A function that starts profiling the request of the current thread
+        :param profiler: 'cprofile' or 'sampling'
+        :param trigger: what asked for the profile, 'header' or 'sample'
+        """
+        local = self._local
+        local.profiler = profiler
+        local.trigger = trigger
+        local.started_at = time.perf_counter()
+        if profiler == 'cprofile':
+            local.profile = cProfile.Profile()
+            local.profile.enable()
+        else:
+            self.sampler.start()
+
+    def finish(self, method, path, endpoint, status):
+        """
+        A function that stops profiling the request of the current thread and stores the profile
+        :param method: the method of the request
+        :param path: the path of the request
+        :param endpoint: the endpoint serving the request
+        :param status: the status code of the response
+        :return: the id of the profile, None if the request was not profiled
+        """
+        data = self._stop()
+        if data is None:
+            return None
+        local = self._local
+        data.update({
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'duration_ms': round((time.perf_counter() - local.started_at) * 1000, 3),
+            'profiled_at': time.time(),
+            'trigger': local.trigger
+        })
+        return self.store.add(data)
+
+    def discard(self):
+        """
+        A function that stops profiling the request of the current thread without storing the profile, used when the
+        request failed before its response was built
+        """
+        self._stop()
+
+    def _stop(self):
+        local = self._local
+        profiler = getattr(local, 'profiler', None)
+        if profiler is None:
+            return None
+        local.profiler = None
+        if profiler == 'cprofile':
+            local.profile.disable()
+            data = {'profiler': profiler, 'stats': local.profile}
+            local.profile = None
+        else:
+            data = {'profiler': profiler, 'samples': self.sampler.stop()}
+        return data
+
+
+def render_profile(profile, output_format):
+    """
+    A function that renders a profile as text
+    :param profile: the stored profile
+    :param output_format: 'pstats' for a cProfile profile or 'collapsed' for a sampled one
+    :return: the text of the profile, raises ValueError if the format doesn't match the profiler
+    """
+    if output_format != PROFILE_FORMATS[profile['profiler']]:
+        raise ValueError(f"the {profile['profiler']} profiles are rendered as {PROFILE_FORMATS[profile['profiler']]}")
+    if output_format == 'pstats':
+        output = io.StringIO()
+        pstats.Stats(profile['stats'], stream=output).sort_stats('cumulative').print_stats(PSTATS_LINES)
+        return output.getvalue()
+    return ''.join(f'{stack} {count}\n' for stack, count in profile['samples'].most_common())
+
+
+def _current_task():
+    # The key of the request being served (its greenlet under gevent, its thread otherwise) and the ident of its OS
+    # thread
+    thread_id = _native('_thread', 'get_ident')()
+    if is_gevent_patched():
+        import gevent
+        return gevent.getcurrent(), thread_id
+    return thread_id, thread_id
+
+
+def _native(module, name):
+    # The function of the standard library, even when gevent replaced it with its cooperative version
+    if is_gevent_patched():
+        return sys.modules['gevent.monkey'].get_original(module, name)
+    return getattr(sys.modules[module], name)
+
+
+def _collapse(frame):
+    # The stack of a frame from the outermost call, in the collapsed format: 'function (file:line)' joined by ';'
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+profile_store = ProfileStore()
+request_profiler = RequestProfiler(profile_store, StackSampler())
@@ -0,0 +1,238 @@
+import random
+import threading
+import time
+from array import array
+
+from flask import current_app
+
+from models import db, Question, on_question_change
+
+# The key of the index holding the ids of all the questions (quiz_category 0 means all the categories)
+ALL_CATEGORIES = 0
+# How many random picks are tried before falling back to filtering the whole category
+SAMPLE_ATTEMPTS = 16
+# The difficulties a question can have, from the easiest to the hardest
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
+
+class QuestionIndex:
+    """
+    An in-memory index of the questions ids per category and per (category, difficulty) bucket, each category and each
+    bucket keeps its ids in an array so a random question can be picked without loading the rows from the database.
+    The index is loaded once, then caught up with the database by the questions ids (see refresh)
+    """
+
+    def __init__(self, ttl=60):
+        """
+        :param ttl: the number of seconds after which the index is refreshed from the database in the background, this
+         picks up the questions added or deleted by other processes
+        """
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._ids = {}
+        self._positions = {}
+        self._max_id = 0
+        self._loaded_at = None
+        self._refresh_thread = None
+        # The number of refreshes reading the database and the ids removed meanwhile, a refresh must not add them back
+        self._refreshes = 0
+        self._removed_ids = set()
+
+    def invalidate(self):
+        """
+        A function that drops the index, it gets reloaded from the database on its next use
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def refresh(self, deletes=True):
+        """
+        A function that catches the index up with the database without blocking its readers: only the questions with an
+        id above the highest loaded one are read, and the ids of the loaded questions are checked to drop the questions
+        deleted by other processes. The readers keep using the current arrays until the changes are applied
+        :param deletes: whether to drop the deleted questions, False when the questions were only added
+        """
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            max_id = self._max_id
+            self._refreshes += 1
+        try:
+            rows = db.session.query(Question.id, Question.category, Question.difficulty) \
+                .filter(Question.id > max_id).order_by(Question.id).all()
+            existing_ids = None
+            if deletes:
+                existing_ids = {question_id for question_id, in
+                                db.session.query(Question.id).filter(Question.id <= max_id)}
+            with self._lock:
+                # The index was dropped meanwhile, its next use reloads it
+                if self._loaded_at is None:
+                    return
+                for question_id, category, difficulty in rows:
+                    if question_id not in self._positions and question_id not in self._removed_ids:
+                        _append(self._ids, self._positions, question_id, int(category), int(difficulty))
+                        self._max_id = max(self._max_id, question_id)
+                if existing_ids is not None:
+                    for question_id in [question_id for question_id in self._positions
+                                        if question_id <= max_id and question_id not in existing_ids]:
+                        self.remove(question_id)
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshes -= 1
+                if not self._refreshes:
+                    self._removed_ids.clear()
+
+    def count(self, category, difficulty=None):
+        """
+        A function that returns the number of questions in a category
+        :param category: the category id, 0 for all the categories
+        :param difficulty: the difficulty of the questions, None for all the difficulties
+        :return: the number of questions in that category (and difficulty)
+        """
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._ids.get(_key(category, difficulty), ()))
+
+    def ids(self, category):
+        """
+        A function that returns the ids of the questions in a category
+        :param category: the category id, 0 for all the categories
+        :return: a list of the questions ids in that category
+        """
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._ids.get(category, ()))
+
+    def shuffled_ids(self, category, size):
+        """
+        A function that returns random distinct question ids of a category in a random order
+        :param category: the category id, 0 for all the categories
+        :param size: the maximum number of ids to return
+        :return: a shuffled list of at most 'size' question ids in that category
+        """
+        with self._lock:
+            self._ensure_loaded()
+            category_ids = self._ids.get(category, ())
+            return random.sample(category_ids, min(size, len(category_ids)))
+
+    def sample(self, category, excluded_ids, difficulty=None):
+        """
+        A function that returns the id of a random question in a category and not in 'excluded_ids'
+        :param category: the category id, 0 for all the categories
+        :param excluded_ids: a set of the ids that must not be returned
+        :param difficulty: the difficulty of the question, None for any difficulty
+        :return: a random question id, None if all the questions in that category (and difficulty) are excluded
+        """
+        with self._lock:
+            self._ensure_loaded()
+            category_ids = self._ids.get(_key(category, difficulty))
+            if not category_ids:
+                return None
+            # Random picks succeed quickly as long as most of the category is not excluded
+            for _ in range(SAMPLE_ATTEMPTS):
+                question_id = category_ids[random.randrange(len(category_ids))]
+                if question_id not in excluded_ids:
+                    return question_id
+            # Most of the category was excluded, filtering the remaining ids instead
+            remaining_ids = [question_id for question_id in category_ids if question_id not in excluded_ids]
+        if not remaining_ids:
+            return None
+        return random.choice(remaining_ids)
+
+    def add(self, question_id, category, difficulty):
+        """
+        A function that adds a question to the index
+        :param question_id: the id of the question
+        :param category: the category id of the question
+        :param difficulty: the difficulty of the question
+        """
+        with self._lock:
+            if self._loaded_at is None or question_id in self._positions:
+                return
+            _append(self._ids, self._positions, question_id, category, difficulty)
+            self._max_id = max(self._max_id, question_id)
+
+    def remove(self, question_id):
+        """
+        A function that removes a question from the index, the last id of each array takes the removed id place so the
+        removal doesn't shift the arrays
+        :param question_id: the id of the question
+        """
+        with self._lock:
+            if self._refreshes:
+                self._removed_ids.add(question_id)
+            positions = self._positions.pop(question_id, None)
+            if positions is None:
+                return
+            for key, position in positions.items():
+                category_ids = self._ids[key]
+                last_id = category_ids.pop()
+                if last_id != question_id:
+                    category_ids[position] = last_id
+                    self._positions[last_id][key] = position
+
+    def on_question_change(self, event, rows):
+        """
+        A listener keeping the index in sync with the questions inserted or deleted through the Question model
+        """
+        if event == 'insert':
+            for row in rows:
+                self.add(row['id'], int(row['category']), int(row['difficulty']))
+        elif event == 'delete':
+            for row in rows:
+                self.remove(row['id'])
+        else:
+            # Many questions were added at once (a bulk import), reading the ones above the highest loaded id
+            self.refresh(deletes=False)
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None:
+            self._load()
+        elif time.monotonic() - self._loaded_at >= self.ttl and self._refresh_thread is None:
+            self._refresh_thread = threading.Thread(target=self._refresh_in_background,
+                                                    args=(current_app._get_current_object(),),
+                                                    name='question-index-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def _load(self):
+        ids = {ALL_CATEGORIES: array('q')}
+        positions = {}
+        max_id = 0
+        rows = db.session.query(Question.id, Question.category, Question.difficulty).order_by(Question.id)
+        for question_id, category, difficulty in rows:
+            _append(ids, positions, question_id, int(category), int(difficulty))
+            max_id = question_id
+        self._ids = ids
+        self._positions = positions
+        self._max_id = max_id
+        self._loaded_at = time.monotonic()
+
+    def _refresh_in_background(self, app):
+        try:
+            with app.app_context():
+                self.refresh()
+        finally:
+            with self._lock:
+                # A failed refresh is tried again after another 'ttl' seconds
+                if self._loaded_at is not None:
+                    self._loaded_at = time.monotonic()
+                self._refresh_thread = None
+
+
+def _key(category, difficulty):
+    # The categories are keyed by their id and the difficulty buckets by (category id, difficulty)
+    return category if difficulty is None else (category, difficulty)
+
+
+def _append(ids, positions, question_id, category, difficulty):
+    positions[question_id] = {}
+    for key in (ALL_CATEGORIES, category, (ALL_CATEGORIES, difficulty), (category, difficulty)):
+        category_ids = ids.setdefault(key, array('q'))
+        positions[question_id][key] = len(category_ids)
+        category_ids.append(question_id)
+
+
+question_index = QuestionIndex()
+on_question_change(question_index.on_question_change)
@@ -0,0 +1,137 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from models import Category, on_question_change
+
+# The maximum number of responses kept, the least recently used one is dropped when the cache is full
+RESPONSE_CACHE_SIZE = 1024
+# The number of seconds a response is kept, this picks up the questions written by other processes
+RESPONSE_CACHE_TTL = 30
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'mimetype', 'etag', 'version', 'expires_at'])
+
+
+class ResponseCache:
+    """
+    An in-process LRU cache of the bodies of the question listings keyed by route and query args. Every cached body is
+    tagged with the data version it was built from, the version is bumped by any question or category write so the
+    stale bodies are never served
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        """
+        :param max_entries: the maximum number of responses kept
+        :param ttl: the number of seconds after which a response is built again
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        A function that returns the cached response of a key
+        :param key: the route and the query args of the request
+        :return: the CachedResponse, None if it is missing, expired or built from an older version of the data
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != self.version or entry.expires_at <= time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype, version):
+        """
+        A function that caches a response body
+        :param key: the route and the query args of the request
+        :param body: the bytes of the response body
+        :param mimetype: the mimetype of the response
+        :param version: the data version read before building the body, the body is dropped if the data changed since
+        :return: the CachedResponse
+        """
+        entry = CachedResponse(body, mimetype, hashlib.sha1(body).hexdigest(), version, time.monotonic() + self.ttl)
+        with self._lock:
+            if version == self.version and self.max_entries > 0:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def bump_version(self, *args):
+        """
+        A function that marks every cached response as stale, it is called after the questions or the categories change
+        """
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def stats(self):
+        """
+        A function that returns the counters of the cache
+        :return: a dictionary of hits, misses, version and size of the cache
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'version': self.version,
+                'size': len(self._entries)
+            }
+
+
+response_cache = ResponseCache()
+on_question_change(response_cache.bump_version)
+
+
+# Bumping the data version whenever a category is written through the ORM, the listings embed the categories
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def bump_response_cache_version(mapper, connection, target):
+    response_cache.bump_version()
+
+
+def cached_listing(view):
+    """
+    A decorator caching the 200 responses of a listing view that got a 'seed' query param, the seed makes the shuffle
+    of the listing deterministic so the same url gives the same body until the data changes. The responses carry an
+    ETag of their body and a request with a matching If-None-Match gets a 304
+    :param view: the view function
+    :return: the wrapped view function
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.args.get('seed') is None or not current_app.config.get('RESPONSE_CACHE_ENABLED', True):
+            return view(*args, **kwargs)
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        entry = response_cache.get(key)
+        if entry is None:
+            # Reading the version first, a write while the view runs leaves the body stale and it won't be kept
+            version = response_cache.version
+            response = current_app.make_response(view(*args, **kwargs))
+            # The streamed listings are too large to be kept, they are sent as they are
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            entry = response_cache.put(key, response.get_data(), response.mimetype, version)
+        response = current_app.response_class(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        # Letting the browsers keep the body but revalidate it on every use
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    return wrapper
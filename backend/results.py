@@ -0,0 +1,244 @@
+import atexit
+import threading
+from collections import Counter, deque
+
+from sqlalchemy import bindparam
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, QuizResult, QuestionStats, CategoryStats
+
+# The maximum number of answers waiting to be written, the new answers are refused when the buffer is full
+RESULTS_BUFFER_SIZE = 10000
+# The number of seconds between two writes of the buffered answers
+RESULTS_FLUSH_INTERVAL = 1.0
+# The maximum number of answers written per transaction
+RESULTS_BATCH_SIZE = 1000
+# The maximum number of answers sent in one request
+MAX_ANSWERS_PER_REQUEST = 1000
+
+
+class ResultsBuffer:
+    """
+    A bounded in-process buffer of the quiz answers, a background thread writes them in batches: a single executemany
+    of the answers then one upsert per stats table, in one transaction. The answers still buffered are written when the
+    process exits
+    """
+
+    def __init__(self, max_size=RESULTS_BUFFER_SIZE, flush_interval=RESULTS_FLUSH_INTERVAL,
+                 batch_size=RESULTS_BATCH_SIZE):
+        """
+        :param max_size: the maximum number of answers waiting to be written
+        :param flush_interval: the number of seconds between two writes
+        :param batch_size: the maximum number of answers written per transaction
+        """
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.app = None
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._answers = deque()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self, app):
+        """
+        A function that starts the background writer, the answers are written to the database of 'app'. The writer is
+        started once, the apps created while it runs share it and their answers go to the database of the first app
+        :param app: the flask app
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.app = app
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='quiz-results-writer', daemon=True)
+            self._thread.start()
+            # Writing the answers still buffered when the process exits, registered once per writer
+            atexit.register(self.stop)
+
+    def put(self, answers):
+        """
+        A function that buffers answers, all of them or none are buffered
+        :param answers: a list of (question_id, correct) tuples
+        :return: whether the answers were buffered, False when the buffer is full (the client should retry later)
+        """
+        with self._lock:
+            if len(self._answers) + len(answers) > self.max_size:
+                self.rejected += len(answers)
+                return False
+            self._answers.extend(answers)
+            self.accepted += len(answers)
+            return True
+
+    def flush(self):
+        """
+        A function that writes all the buffered answers, batch by batch
+        :return: the number of answers written
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._answers.popleft() for _ in range(min(self.batch_size, len(self._answers)))]
+                if not batch:
+                    return written
+                try:
+                    with self.app.app_context():
+                        batch_written = write_answers(batch)
+                except Exception as error:
+                    # Keeping the answers for the next flush, the buffer fills up and refuses new answers while the
+                    # database is failing. The errors that are not database errors are raised to be logged
+                    with self._lock:
+                        self.failed_flushes += 1
+                        self._answers.extendleft(reversed(batch))
+                    if not isinstance(error, SQLAlchemyError):
+                        raise
+                    return written
+                written += batch_written
+                with self._lock:
+                    self.written += batch_written
+                    self.dropped += len(batch) - batch_written
+
+    def stop(self):
+        """
+        A function that stops the background writer then writes the answers still buffered
+        """
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+            self._thread = None
+            atexit.unregister(self.stop)
+        if self.app is not None:
+            self.flush()
+
+    def stats(self):
+        """
+        A function that returns the counters of the buffer
+        :return: a dictionary of the buffered, accepted, rejected, written and dropped answers and the failed flushes
+        """
+        with self._lock:
+            return {
+                'buffered': len(self._answers),
+                'capacity': self.max_size,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed_flushes': self.failed_flushes
+            }
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # The writer must keep running, the error is logged and the answers are retried on the next flush
+                self.app.logger.exception("Writing the quiz results failed")
+
+
+def write_answers(answers):
+    """
+    A function that writes a batch of answers and adds them to the questions and categories stats in one transaction,
+    the answers of questions that don't exist are dropped
+    :param answers: a list of (question_id, correct) tuples
+    :return: the number of answers written
+    """
+    try:
+        question_ids = {question_id for question_id, _ in answers}
+        categories = dict(db.session.query(Question.id, Question.category).filter(Question.id.in_(question_ids)))
+        rows = [{'question_id': question_id, 'category': categories[question_id], 'correct': correct}
+                for question_id, correct in answers if question_id in categories]
+        if not rows:
+            return 0
+        question_plays = Counter(row['question_id'] for row in rows)
+        question_correct = Counter(row['question_id'] for row in rows if row['correct'])
+        category_plays = Counter(row['category'] for row in rows)
+        category_correct = Counter(row['category'] for row in rows if row['correct'])
+        db.session.execute(QuizResult.__table__.insert(), rows)
+        _add_to_stats(QuestionStats.__table__, 'question_id', [{
+            'question_id': question_id,
+            'category': categories[question_id],
+            'plays': plays,
+            'correct': question_correct[question_id]
+        } for question_id, plays in question_plays.items()])
+        _add_to_stats(CategoryStats.__table__, 'category', [{
+            'category': category,
+            'plays': plays,
+            'correct': category_correct[category]
+        } for category, plays in category_plays.items()])
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+
+def get_question_stats(question_id, category):
+    """
+    A function that returns the aggregated results of a question and of its category, the answers still buffered are
+    not counted yet
+    :param question_id: the id of the question
+    :param category: the category id of the question
+    :return: a dictionary of plays, correct and correct_rate of the question and of its category
+    """
+    question_stats = QuestionStats.query.get(question_id)
+    category_stats = CategoryStats.query.get(category)
+    serialized = question_stats.format() if question_stats else {'plays': 0, 'correct': 0, 'correct_rate': None}
+    serialized['category'] = category_stats.format() if category_stats else {
+        'id': category,
+        'plays': 0,
+        'correct': 0,
+        'correct_rate': None
+    }
+    return serialized
+
+
+def parse_answers(values):
+    """
+    A function that validates the answers of a quiz results request
+    :param values: a list of objects with question_id (an int) and correct (a boolean)
+    :return: a list of (question_id, correct) tuples, raises ValueError if an answer is invalid or there are no answers
+     or too many of them
+    """
+    if not isinstance(values, list) or not 0 < len(values) <= MAX_ANSWERS_PER_REQUEST:
+        raise ValueError(f"between 1 and {MAX_ANSWERS_PER_REQUEST} answers are allowed")
+    answers = []
+    for value in values:
+        if not isinstance(value, dict) or not isinstance(value.get('correct'), bool) \
+                or not isinstance(value.get('question_id'), int) or isinstance(value.get('question_id'), bool):
+            raise ValueError("each answer must have an int question_id and a boolean correct")
+        answers.append((value['question_id'], value['correct']))
+    return answers
+
+
+def _add_to_stats(table, key, rows):
+    # PostgreSQL adds the counts with a single INSERT ... ON CONFLICT DO UPDATE, the other databases update the
+    # existing rows then insert the missing ones
+    if db.engine.dialect.name == 'postgresql':
+        statement = postgresql_insert(table)
+        db.session.execute(statement.on_conflict_do_update(index_elements=[table.c[key]], set_={
+            'plays': table.c.plays + statement.excluded.plays,
+            'correct': table.c.correct + statement.excluded.correct
+        }), rows)
+        return
+    existing = {row[0] for row in db.session.execute(
+        table.select().with_only_columns([table.c[key]]).where(table.c[key].in_([row[key] for row in rows])))}
+    updates = [row for row in rows if row[key] in existing]
+    if updates:
+        db.session.execute(table.update().where(table.c[key] == bindparam('row_key')).values(
+            plays=table.c.plays + bindparam('row_plays'), correct=table.c.correct + bindparam('row_correct')),
+            [{'row_key': row[key], 'row_plays': row['plays'], 'row_correct': row['correct']} for row in updates])
+    inserts = [row for row in rows if row[key] not in existing]
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+
+
+results_buffer = ResultsBuffer()
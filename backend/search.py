@@ -0,0 +1,180 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import func, literal_column
+
+from models import db, Question, on_question_change
+from helper import query_question_rows
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    A function that splits a text into lowercase words
+    :param text: the text to split
+    :return: a list of the words in the text
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class PostgresSearch:
+    """
+    Full text search using PostgreSQL tsvectors, the documents match the expressions of the GIN indexes created by
+    migrations/001_search_indexes.sql so the searches use the indexes instead of scanning the questions table
+    """
+
+    def search(self, search_term, include_answers, offset, limit):
+        """
+        A function that returns the questions matching every word of the search term (as a prefix), best ranked first
+        :param search_term: the text to search for
+        :param include_answers: whether the answers are searched too
+        :param offset: the number of matching questions to skip
+        :param limit: the maximum number of questions to return
+        :return: a tuple of the matching questions rows (QUESTION_COLUMNS) in the requested range and the total number of
+         matching questions
+        """
+        words = tokenize(search_term)
+        if not words:
+            return [], 0
+        # The regconfig and the separator are rendered literally so the expressions match the indexed ones
+        config = literal_column("'simple'::regconfig")
+        text = Question.question
+        if include_answers:
+            text = Question.question.op('||')(literal_column("' '")).op('||')(Question.answer)
+        document = func.to_tsvector(config, text)
+        ts_query = func.to_tsquery(config, ' & '.join(f'{word}:*' for word in words))
+        matches = query_question_rows().filter(document.op('@@')(ts_query))
+        total = matches.count()
+        questions = matches.order_by(func.ts_rank(document, ts_query).desc(), Question.id) \
+            .offset(offset).limit(limit).all()
+        return questions, total
+
+
+class InvertedIndexSearch:
+    """
+    Full text search using an in-memory inverted index of the words of the questions and the answers, used when the
+    database is not PostgreSQL (ex: SQLite in tests)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._postings = {'question': defaultdict(dict), 'answer': defaultdict(dict)}
+        self._words = {'question': [], 'answer': []}
+
+    def search(self, search_term, include_answers, offset, limit):
+        """
+        A function that returns the questions matching every word of the search term (as a prefix), best ranked first
+        :param search_term: the text to search for
+        :param include_answers: whether the answers are searched too
+        :param offset: the number of matching questions to skip
+        :param limit: the maximum number of questions to return
+        :return: a tuple of the matching questions rows (QUESTION_COLUMNS) in the requested range and the total number of
+         matching questions
+        """
+        words = tokenize(search_term)
+        if not words:
+            return [], 0
+        fields = ('question', 'answer') if include_answers else ('question',)
+        with self._lock:
+            self._ensure_loaded()
+            # Every word of the search term must match, the rank is the number of occurrences of the matched words
+            ranks = None
+            for word in words:
+                word_ranks = defaultdict(int)
+                for field in fields:
+                    for indexed_word in self._prefixed_words(field, word):
+                        for question_id, occurrences in self._postings[field][indexed_word].items():
+                            word_ranks[question_id] += occurrences
+                if ranks is None:
+                    ranks = word_ranks
+                else:
+                    ranks = {question_id: rank + word_ranks[question_id] for question_id, rank in ranks.items()
+                             if question_id in word_ranks}
+                if not ranks:
+                    return [], 0
+        ranked_ids = sorted(ranks, key=lambda question_id: (-ranks[question_id], question_id))
+        page_ids = ranked_ids[offset:offset + limit]
+        questions_by_id = {}
+        if page_ids:
+            questions_by_id = {question.id: question
+                               for question in query_question_rows().filter(Question.id.in_(page_ids)).all()}
+        questions = [questions_by_id[question_id] for question_id in page_ids if question_id in questions_by_id]
+        return questions, len(ranked_ids)
+
+    def on_question_change(self, event, rows):
+        """
+        A listener keeping the index in sync with the questions inserted or deleted through the Question model
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            if event == 'insert':
+                for row in rows:
+                    self._add(row['id'], row['question'], row['answer'])
+            elif event == 'delete':
+                for row in rows:
+                    self._remove(row['id'], row['question'], row['answer'])
+            else:
+                self._loaded = False
+
+    def _prefixed_words(self, field, prefix):
+        words = self._words[field]
+        position = bisect_left(words, prefix)
+        while position < len(words) and words[position].startswith(prefix):
+            yield words[position]
+            position += 1
+
+    def _add(self, question_id, question, answer, keep_words_sorted=True):
+        for field, text in (('question', question), ('answer', answer)):
+            postings = self._postings[field]
+            for word in tokenize(text):
+                if keep_words_sorted and word not in postings:
+                    words = self._words[field]
+                    words.insert(bisect_left(words, word), word)
+                postings[word][question_id] = postings[word].get(question_id, 0) + 1
+
+    def _remove(self, question_id, question, answer):
+        for field, text in (('question', question), ('answer', answer)):
+            postings = self._postings[field]
+            for word in set(tokenize(text)):
+                if word not in postings:
+                    continue
+                postings[word].pop(question_id, None)
+                if not postings[word]:
+                    del postings[word]
+                    words = self._words[field]
+                    del words[bisect_left(words, word)]
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._postings = {'question': defaultdict(dict), 'answer': defaultdict(dict)}
+        self._words = {'question': [], 'answer': []}
+        for question_id, question, answer in db.session.query(Question.id, Question.question, Question.answer):
+            self._add(question_id, question, answer, keep_words_sorted=False)
+        # Sorting the words once instead of inserting them one by one
+        self._words = {field: sorted(postings) for field, postings in self._postings.items()}
+        self._loaded = True
+
+
+postgres_search = PostgresSearch()
+inverted_index_search = InvertedIndexSearch()
+on_question_change(inverted_index_search.on_question_change)
+
+
+def search_questions(search_term, include_answers=False, offset=0, limit=10):
+    """
+    A function that searches the questions with the search backend of the database in use
+    :param search_term: the text to search for
+    :param include_answers: whether the answers are searched too
+    :param offset: the number of matching questions to skip
+    :param limit: the maximum number of questions to return
+    :return: a tuple of the matching questions in the requested range and the total number of matching questions
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return postgres_search.search(search_term, include_answers, offset, limit)
+    return inverted_index_search.search(search_term, include_answers, offset, limit)
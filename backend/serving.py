@@ -0,0 +1,70 @@
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+# The serving modes selectable with SERVING_MODE
+SERVING_MODES = ('threaded', 'gevent')
+# The number of requests served at once by the threaded mode (like a worker with that many threads)
+SERVING_THREADS = 8
+# The number of requests served at once by the gevent mode
+SERVING_GREENLETS = 1000
+
+
+def patch_for_gevent():
+    """
+    A function that makes the blocking calls (sockets, threads, psycopg2) cooperative so a waiting request yields to the
+    others instead of holding a thread, it must run before flask, sqlalchemy and psycopg2 are imported
+    """
+    try:
+        from gevent import monkey
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        raise RuntimeError("SERVING_MODE='gevent' needs the gevent and psycogreen packages "
+                           "(pip install gevent psycogreen)")
+    monkey.patch_all()
+    patch_psycopg()
+
+
+class ThreadPoolWSGIServer(BaseWSGIServer):
+    """
+    A WSGI server serving the requests with a fixed number of threads, each request holds a thread until it is done
+    """
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.executor = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_in_thread, request, client_address)
+
+    def _process_request_in_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve(app, mode, host, port, concurrency=None):
+    """
+    A function that serves the app until the process is stopped
+    :param app: the flask app
+    :param mode: 'threaded' (a thread per request in flight) or 'gevent' (a greenlet per request in flight, the
+     process must be patched first with patch_for_gevent)
+    :param host: the host to listen on
+    :param port: the port to listen on
+    :param concurrency: the maximum number of requests served at once
+    """
+    # Exiting normally on SIGTERM so the atexit handlers run (ex: writing the buffered quiz results)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if mode == 'gevent':
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+        WSGIServer((host, port), app, spawn=Pool(concurrency or SERVING_GREENLETS)).serve_forever()
+    elif mode == 'threaded':
+        ThreadPoolWSGIServer(host, port, app, concurrency or SERVING_THREADS).serve_forever()
+    else:
+        raise ValueError(f"unknown serving mode '{mode}', use one of {', '.join(SERVING_MODES)}")
@@ -0,0 +1,193 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from models import Question
+from helper import query_question_rows, format_question_row
+
+# The maximum number of questions dealt to a quiz session
+QUIZ_DECK_SIZE = 100
+# The number of seconds a quiz session is kept after its last use
+QUIZ_SESSION_TTL = 3600
+# The maximum number of quiz sessions kept in the process by the memory backend
+MAX_QUIZ_SESSIONS = 10000
+
+
+class MemorySessionBackend:
+    """
+    Keeps the quiz sessions decks in the process, the least recently used session is dropped when the store is full and
+    a session expires 'ttl' seconds after its last use. The sessions are not shared between worker processes
+    """
+
+    def __init__(self, max_sessions=MAX_QUIZ_SESSIONS, ttl=QUIZ_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def create(self, session_id, deck):
+        with self._lock:
+            now = time.monotonic()
+            # The sessions are ordered by last use so the expired ones are at the front
+            while self._sessions and next(iter(self._sessions.values()))[1] <= now:
+                self._sessions.popitem(last=False)
+            self._sessions[session_id] = (list(deck), now + self.ttl)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def pop(self, session_id):
+        with self._lock:
+            deck, expires_at = self._sessions.get(session_id, (None, 0))
+            if deck is None or expires_at <= time.monotonic():
+                self._sessions.pop(session_id, None)
+                raise KeyError(session_id)
+            self._sessions[session_id] = (deck, time.monotonic() + self.ttl)
+            self._sessions.move_to_end(session_id)
+            if not deck:
+                return None, 0
+            return deck.pop(), len(deck)
+
+
+class RedisSessionBackend:
+    """
+    Keeps the quiz sessions decks in Redis lists so every worker process shares them, 'client' is a redis-py client or
+    any object with the same rpush, rpop, llen and expire commands (ex: LocalRedis)
+    """
+
+    # Question ids start at 1, a 0 at the head of the list keeps the list (and the session) alive once it is empty
+    EMPTY_MARKER = 0
+
+    def __init__(self, client, ttl=QUIZ_SESSION_TTL, prefix='quiz_session:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def create(self, session_id, deck):
+        key = self.prefix + session_id
+        self.client.rpush(key, self.EMPTY_MARKER, *deck)
+        self.client.expire(key, self.ttl)
+
+    def pop(self, session_id):
+        key = self.prefix + session_id
+        question_id = self.client.rpop(key)
+        if question_id is None:
+            raise KeyError(session_id)
+        question_id = int(question_id)
+        if question_id == self.EMPTY_MARKER:
+            self.client.rpush(key, self.EMPTY_MARKER)
+            question_id = None
+        self.client.expire(key, self.ttl)
+        return question_id, max(self.client.llen(key) - 1, 0)
+
+
+class LocalRedis:
+    """
+    An in-process stand-in for the few Redis list commands used by RedisSessionBackend, for tests and development
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lists = {}
+        self._expires_at = {}
+
+    def rpush(self, key, *values):
+        with self._lock:
+            self._expire_if_needed(key)
+            self._lists.setdefault(key, []).extend(str(value).encode() for value in values)
+            return len(self._lists[key])
+
+    def rpop(self, key):
+        with self._lock:
+            self._expire_if_needed(key)
+            values = self._lists.get(key)
+            if not values:
+                return None
+            value = values.pop()
+            if not values:
+                self._delete(key)
+            return value
+
+    def llen(self, key):
+        with self._lock:
+            self._expire_if_needed(key)
+            return len(self._lists.get(key, ()))
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if key not in self._lists:
+                return False
+            self._expires_at[key] = time.monotonic() + seconds
+            return True
+
+    def _expire_if_needed(self, key):
+        if key in self._expires_at and self._expires_at[key] <= time.monotonic():
+            self._delete(key)
+
+    def _delete(self, key):
+        self._lists.pop(key, None)
+        self._expires_at.pop(key, None)
+
+
+class QuizSessions:
+    """
+    Server side quiz sessions, each session holds a shuffled deck of question ids of the chosen category so the next
+    question is popped from the deck instead of the client sending all the previous questions
+    """
+
+    def __init__(self, backend, index, deck_size=QUIZ_DECK_SIZE):
+        """
+        :param backend: the store of the decks (MemorySessionBackend or RedisSessionBackend)
+        :param index: the QuestionIndex the decks are dealt from
+        :param deck_size: the maximum number of questions dealt to a session
+        """
+        self.backend = backend
+        self.index = index
+        self.deck_size = deck_size
+
+    def create(self, quiz_category):
+        """
+        A function that creates a quiz session for a category
+        :param quiz_category: the category id of the quiz, 0 for all the categories
+        :return: a tuple of the session id and the number of questions in its deck
+        """
+        deck = self.index.shuffled_ids(quiz_category, self.deck_size)
+        session_id = secrets.token_urlsafe(16)
+        self.backend.create(session_id, deck)
+        return session_id, len(deck)
+
+    def next_question(self, session_id):
+        """
+        A function that pops the next question of a quiz session
+        :param session_id: the id of the session
+        :return: a tuple of the serialized question (None when the deck is empty) and the number of questions left,
+         raises KeyError if the session doesn't exist or expired
+        """
+        question_id, remaining = self.backend.pop(session_id)
+        while question_id is not None:
+            question = query_question_rows().filter(Question.id == question_id).first()
+            if question is not None:
+                return format_question_row(question), remaining
+            # The question was deleted after the deck was dealt, skipping it
+            question_id, remaining = self.backend.pop(session_id)
+        return None, remaining
+
+
+def make_session_backend(config):
+    """
+    A function that returns the quiz sessions backend chosen by the app config: QUIZ_SESSION_BACKEND is 'memory'
+    (default), 'redis' (needs the redis package and REDIS_URL) or a backend object
+    :param config: the app config
+    :return: the quiz sessions backend
+    """
+    backend = config.get('QUIZ_SESSION_BACKEND', 'memory')
+    ttl = config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+    if backend == 'memory':
+        return MemorySessionBackend(config.get('MAX_QUIZ_SESSIONS', MAX_QUIZ_SESSIONS), ttl)
+    if backend == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("QUIZ_SESSION_BACKEND='redis' needs the redis package (pip install redis)")
+        return RedisSessionBackend(redis.Redis.from_url(config['REDIS_URL']), ttl)
+    return backend
@@ -0,0 +1,421 @@
+import bisect
+import fcntl
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from array import array
+
+from sqlalchemy import event
+
+from models import db, Question, Category, on_question_change
+from question_index import ALL_CATEGORIES, SAMPLE_ATTEMPTS
+
+# The number of seconds between the first write and the rebuild of the snapshot, the writes in between are picked up
+# by the same rebuild
+SNAPSHOT_REBUILD_DELAY = 1.0
+
+SNAPSHOT_MAGIC = b'TRIVSNAP'
+SNAPSHOT_FORMAT_VERSION = 1
+# The sections of the snapshot file, in order, with the typecode of their items. The questions are sorted by id:
+# - ids, categories, difficulties: one item per question
+# - text_offsets: the offsets of the question then the answer of each question in text_blob, plus the end offset
+# - by_category: the positions of the questions sorted by (category, difficulty, id), a category (and a difficulty
+#   of a category) is a contiguous range of it
+# - by_category_difficulties: the difficulties of the questions in the by_category order
+# - category_ids, category_starts: the categories and the start of their range in by_category, plus the end offset
+# - category_offsets, category_blob: the categories types, like text_offsets and text_blob
+SNAPSHOT_SECTIONS = (
+    ('ids', 'q'),
+    ('categories', 'q'),
+    ('difficulties', 'q'),
+    ('text_offsets', 'Q'),
+    ('by_category', 'q'),
+    ('by_category_difficulties', 'q'),
+    ('category_ids', 'q'),
+    ('category_starts', 'q'),
+    ('category_offsets', 'Q'),
+    ('text_blob', 'B'),
+    ('category_blob', 'B'),
+)
+# The header: the magic, the format version, the number of questions, the time the build started (ns since the epoch)
+# then the offset and the length in bytes of each section
+_HEADER = struct.Struct('<8sIQQ' + 'QQ' * len(SNAPSHOT_SECTIONS))
+
+
+class QuestionSnapshot:
+    """
+    A read-only view of a snapshot file, the file is mapped in memory so the processes opening it share its pages
+    instead of each holding a copy of the questions
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the path of the snapshot file, raises ValueError if it is not a snapshot
+        """
+        with open(path, 'rb') as snapshot_file:
+            self.inode = os.fstat(snapshot_file.fileno()).st_ino
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"{path} is not a questions snapshot")
+        magic, format_version, self.size, self.built_at_ns, *sections = _HEADER.unpack_from(self._mmap)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"{path} is not a questions snapshot of version {SNAPSHOT_FORMAT_VERSION}")
+        view = memoryview(self._mmap)
+        for number, (name, typecode) in enumerate(SNAPSHOT_SECTIONS):
+            offset, length = sections[2 * number], sections[2 * number + 1]
+            setattr(self, f'_{name}', view[offset:offset + length].cast(typecode))
+        self.nbytes = len(self._mmap)
+        self._category_positions = {category: position for position, category in enumerate(self._category_ids)}
+
+    def count(self, category):
+        """
+        A function that returns the number of questions in a category
+        :param category: the category id, 0 for all the categories
+        :return: the number of questions in that category
+        """
+        return sum(end - start for start, end in self._ranges(category))
+
+    def get(self, question_id):
+        """
+        A function that returns a question
+        :param question_id: the id of the question
+        :return: the serialized question, None if it is not in the snapshot
+        """
+        position = bisect.bisect_left(self._ids, question_id)
+        if position == self.size or self._ids[position] != question_id:
+            return None
+        return self._format(position)
+
+    def page(self, step, page=1, cursor=None):
+        """
+        A function that returns a page of the questions ordered by id, like get_paginated_data does
+        :param step: the number of questions per page
+        :param page: the page number, used when no cursor is given
+        :param cursor: the id of the last question seen
+        :return: a tuple of the serialized questions of the page (None if the page is empty) and the cursor of the
+         next page (None if there is no next page)
+        """
+        if cursor is not None:
+            start = bisect.bisect_right(self._ids, cursor)
+        elif page > 0:
+            start = (page - 1) * step
+        else:
+            return None, None
+        end = min(start + step, self.size)
+        if start >= end:
+            return None, None
+        next_cursor = self._ids[end - 1] if end < self.size else None
+        return [self._format(position) for position in range(start, end)], next_cursor
+
+    def in_category(self, category):
+        """
+        A function that returns the questions of a category
+        :param category: the category id
+        :return: a list of the serialized questions of that category
+        """
+        return list(self.iter_category(category))
+
+    def iter_category(self, category):
+        """
+        A function that yields the questions of a category, serializing them one at a time
+        :param category: the category id
+        :return: a generator of the serialized questions of that category
+        """
+        for start, end in self._ranges(category):
+            for index in range(start, end):
+                yield self._format(self._by_category[index])
+
+    def sample(self, category, excluded_ids, difficulty=None):
+        """
+        A function that returns the id of a random question in a category and not in 'excluded_ids', like
+        QuestionIndex.sample() does
+        :param category: the category id, 0 for all the categories
+        :param excluded_ids: a set of the ids that must not be returned
+        :param difficulty: the difficulty of the question, None for any difficulty
+        :return: a random question id, None if all the questions in that category (and difficulty) are excluded
+        """
+        ranges = self._ranges(category, difficulty)
+        total = sum(end - start for start, end in ranges)
+        if not total:
+            return None
+        # Random picks succeed quickly as long as most of the category is not excluded
+        for _ in range(SAMPLE_ATTEMPTS):
+            index = random.randrange(total)
+            for start, end in ranges:
+                if index < end - start:
+                    break
+                index -= end - start
+            question_id = self._ids[self._by_category[start + index]]
+            if question_id not in excluded_ids:
+                return question_id
+        # Most of the category was excluded, filtering the remaining ids instead
+        remaining_ids = [self._ids[self._by_category[index]] for start, end in ranges for index in range(start, end)
+                         if self._ids[self._by_category[index]] not in excluded_ids]
+        if not remaining_ids:
+            return None
+        return random.choice(remaining_ids)
+
+    def get_next_question(self, previous_questions_ids, quiz_category, difficulties=None):
+        """
+        A function that returns a random question that is in the category 'quiz_category' and not in
+         'previous_questions_ids', like helper.get_next_question() does but without querying the database
+        :param previous_questions_ids: a list of previous questions ids
+        :param quiz_category: the category id of the quiz, 0 for all the categories
+        :param difficulties: the difficulties to pick the question from, the first one that still has questions is
+         used, None for any difficulty
+        :return: a serialized question, None if all the questions of that category were already displayed
+        """
+        excluded_ids = set(previous_questions_ids)
+        for difficulty in difficulties or [None]:
+            question_id = self.sample(quiz_category, excluded_ids, difficulty)
+            if question_id is not None:
+                return self.get(question_id)
+        return None
+
+    def categories_map(self):
+        """
+        A function that returns the categories of the snapshot
+        :return: a map of the categories where keys are categories ids and values are categories types
+        """
+        return {f'{category}': str(self._category_blob[self._category_offsets[position]:
+                                                       self._category_offsets[position + 1]], 'utf-8')
+                for position, category in enumerate(self._category_ids)}
+
+    def _ranges(self, category, difficulty=None):
+        # The ranges of by_category holding the questions of a category (all of them for category 0) and difficulty
+        if category == ALL_CATEGORIES:
+            positions = range(len(self._category_ids))
+        elif category in self._category_positions:
+            positions = [self._category_positions[category]]
+        else:
+            return []
+        ranges = []
+        for position in positions:
+            start, end = self._category_starts[position], self._category_starts[position + 1]
+            if difficulty is not None:
+                # The difficulties are sorted inside the range of a category
+                start, end = (bisect.bisect_left(self._by_category_difficulties, difficulty, start, end),
+                              bisect.bisect_right(self._by_category_difficulties, difficulty, start, end))
+            if start < end:
+                ranges.append((start, end))
+        return ranges
+
+    def _format(self, position):
+        text_start, answer_start, answer_end = self._text_offsets[2 * position:2 * position + 3]
+        return {
+            'id': self._ids[position],
+            'question': str(self._text_blob[text_start:answer_start], 'utf-8'),
+            'answer': str(self._text_blob[answer_start:answer_end], 'utf-8'),
+            'category': self._categories[position],
+            'difficulty': self._difficulties[position]
+        }
+
+
+def build_snapshot(path):
+    """
+    A function that writes a snapshot of the questions and the categories tables to 'path', the snapshot is written
+    to a temporary file then moved over 'path' so the readers see either the old snapshot or the new one
+    :param path: the path of the snapshot file
+    :return: the number of questions in the snapshot
+    """
+    # Recording the time before reading, a write committed after it marks this snapshot stale
+    built_at_ns = time.time_ns()
+    sections = {name: array(typecode) for name, typecode in SNAPSHOT_SECTIONS}
+    text_blob = bytearray()
+    rows = db.session.query(Question.id, Question.category, Question.difficulty, Question.question, Question.answer)
+    sections['text_offsets'].append(0)
+    for question_id, category, difficulty, question, answer in rows.order_by(Question.id).yield_per(1000):
+        sections['ids'].append(question_id)
+        sections['categories'].append(category)
+        sections['difficulties'].append(difficulty)
+        text_blob += question.encode('utf-8')
+        sections['text_offsets'].append(len(text_blob))
+        text_blob += answer.encode('utf-8')
+        sections['text_offsets'].append(len(text_blob))
+    sections['text_blob'].frombytes(text_blob)
+    positions = sorted(range(len(sections['ids'])), key=lambda position: (
+        sections['categories'][position], sections['difficulties'][position], sections['ids'][position]))
+    sections['by_category'].extend(positions)
+    sections['by_category_difficulties'].extend(sections['difficulties'][position] for position in positions)
+    # Every category gets a range, the categories without questions get an empty one
+    categories = db.session.query(Category.id, Category.type).order_by(Category.id).all()
+    question_categories = [sections['categories'][position] for position in positions]
+    category_blob = bytearray()
+    sections['category_offsets'].append(0)
+    for category, category_type in categories:
+        sections['category_ids'].append(category)
+        sections['category_starts'].append(bisect.bisect_left(question_categories, category))
+        category_blob += (category_type or '').encode('utf-8')
+        sections['category_offsets'].append(len(category_blob))
+    sections['category_starts'].append(len(positions))
+    sections['category_blob'].frombytes(category_blob)
+    # Laying out the sections after the header, each one aligned on 8 bytes
+    layout = []
+    offset = _HEADER.size
+    for name, _ in SNAPSHOT_SECTIONS:
+        offset += -offset % 8
+        length = len(sections[name]) * sections[name].itemsize
+        layout += [offset, length]
+        offset += length
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(file_descriptor, 'wb') as snapshot_file:
+            snapshot_file.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(sections['ids']),
+                                             built_at_ns, *layout))
+            for number, (name, _) in enumerate(SNAPSHOT_SECTIONS):
+                snapshot_file.write(b'\0' * (layout[2 * number] - snapshot_file.tell()))
+                sections[name].tofile(snapshot_file)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return len(sections['ids'])
+
+
+class SnapshotStore:
+    """
+    The snapshot opened by the current process. Every write marks the snapshot stale for all the processes (by touching
+    a marker file next to it) and schedules a rebuild, the reads fall back to the database until the new snapshot is
+    swapped in
+    """
+
+    def __init__(self, rebuild_delay=SNAPSHOT_REBUILD_DELAY):
+        """
+        :param rebuild_delay: the number of seconds between a write and the rebuild of the snapshot
+        """
+        self.rebuild_delay = rebuild_delay
+        self.path = None
+        self.app = None
+        self.hits = 0
+        self.fallbacks = 0
+        self.rebuilds = 0
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._timer = None
+
+    def configure(self, app, path):
+        """
+        A function that opens the snapshot of 'path', building it if it doesn't exist yet
+        :param app: the flask app, the rebuilds read its database
+        :param path: the path of the snapshot file, None to serve every read from the database
+        """
+        with self._lock:
+            self.app = app
+            self.path = path
+            self._snapshot = None
+        if path is not None and not os.path.exists(path):
+            self.rebuild()
+
+    def current(self):
+        """
+        A function that returns the snapshot to serve a read from, the snapshot is opened again when another process
+        swapped it
+        :return: the QuestionSnapshot, None if there is no snapshot or it is stale (the read must use the database)
+        """
+        if self.path is None:
+            return None
+        snapshot = self._open()
+        with self._lock:
+            if snapshot is None:
+                self.fallbacks += 1
+            else:
+                self.hits += 1
+        return snapshot
+
+    def rebuild(self):
+        """
+        A function that builds the snapshot again from the database, the processes building it at the same time take
+        turns so the last snapshot swapped in is the most recent one
+        :return: the number of questions in the snapshot
+        """
+        with open(f'{self.path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self.app.app_context():
+                size = build_snapshot(self.path)
+        with self._lock:
+            self.rebuilds += 1
+        return size
+
+    def mark_stale(self, *args):
+        """
+        A function that marks the snapshot stale for every process then schedules its rebuild, it is called after the
+        questions or the categories change
+        """
+        if self.path is None:
+            return
+        with open(f'{self.path}.stale', 'a'):
+            os.utime(f'{self.path}.stale')
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.rebuild_delay, self._run_rebuild)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def stats(self):
+        """
+        A function that returns the state of the snapshot
+        :return: a dictionary of the path, size, bytes, stale state, hits, fallbacks and rebuilds of the snapshot
+        """
+        snapshot = self._open() if self.path is not None else None
+        with self._lock:
+            return {
+                'path': self.path,
+                'size': snapshot.size if snapshot else None,
+                'bytes': snapshot.nbytes if snapshot else None,
+                'stale': self.path is not None and snapshot is None,
+                'hits': self.hits,
+                'fallbacks': self.fallbacks,
+                'rebuilds': self.rebuilds
+            }
+
+    def _open(self):
+        # The up to date snapshot, opened again when another process swapped it, None when it is missing or stale
+        try:
+            inode = os.stat(self.path).st_ino
+            marked_at_ns = _marker_time_ns(self.path)
+            with self._lock:
+                if self._snapshot is None or self._snapshot.inode != inode:
+                    self._snapshot = QuestionSnapshot(self.path)
+                snapshot = self._snapshot
+        except (OSError, ValueError):
+            return None
+        if marked_at_ns is not None and marked_at_ns >= snapshot.built_at_ns:
+            return None
+        return snapshot
+
+    def _run_rebuild(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.rebuild()
+        except Exception:
+            # The reads keep using the database until the next write schedules another rebuild
+            self.app.logger.exception("Rebuilding the questions snapshot failed")
+
+
+def _marker_time_ns(path):
+    # The time of the last write of any process, None if nothing was written since the marker was created
+    try:
+        return os.stat(f'{path}.stale').st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+snapshot_store = SnapshotStore()
+on_question_change(snapshot_store.mark_stale)
+
+
+# Marking the snapshot stale whenever a category is written through the ORM, the snapshot holds the categories
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def mark_snapshot_stale(mapper, connection, target):
+    snapshot_store.mark_stale()
@@ -0,0 +1,62 @@
+import os
+import time
+
+from models import db
+from category_cache import category_cache
+from question_index import question_index, ALL_CATEGORIES
+from counters import question_counters
+from duplicates import duplicate_index
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def is_enabled(config, key):
+    """
+    A function that reads a boolean setting from the app config then from the environment
+    :param config: the app config
+    :param key: the name of the setting
+    :return: whether the setting is '1', 'true' or 'yes' (or True)
+    """
+    return str(config.get(key, os.environ.get(key, ''))).lower() in ('1', 'true', 'yes')
+
+
+def init_db():
+    """
+    A function that creates the missing tables then applies the SQL migrations in order, the migrations can be applied
+    again safely. The migrations are written for PostgreSQL, they are skipped on the other databases
+    :return: the names of the applied migrations
+    """
+    db.create_all(bind=None)
+    if db.engine.dialect.name != 'postgresql':
+        return []
+    applied = []
+    for name in sorted(os.listdir(MIGRATIONS_DIRECTORY)):
+        if not name.endswith('.sql'):
+            continue
+        with open(os.path.join(MIGRATIONS_DIRECTORY, name)) as migration_file:
+            migration = migration_file.read()
+        connection = db.engine.raw_connection()
+        try:
+            connection.cursor().execute(migration)
+            connection.commit()
+        finally:
+            connection.close()
+        applied.append(name)
+    return applied
+
+
+def preload_caches():
+    """
+    A function that loads the categories, the questions ids index, the questions counts and the duplicates index before
+    the first request
+    :return: a dictionary of the number of seconds each cache took to load
+    """
+    durations = {}
+    for name, load in (('categories', category_cache.get_map),
+                       ('question_index', lambda: question_index.count(ALL_CATEGORIES)),
+                       ('counters', question_counters.total),
+                       ('duplicates', duplicate_index.refresh)):
+        start = time.perf_counter()
+        load()
+        durations[name] = time.perf_counter() - start
+    return durations
@@ -1,9 +1,17 @@
 import unittest
+import gzip
 import json
+import tempfile
+from unittest import mock
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question
+from models import setup_db, db, Question, Category
+from category_cache import category_cache
+from results import results_buffer, RESULTS_BUFFER_SIZE
+from snapshot import snapshot_store
+from question_index import question_index
+from duplicates import duplicate_index, content_hash, minhash_signature
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -42,6 +50,71 @@ class TriviaTestCase(unittest.TestCase):
                     {'1': "Science", '2': "Art", '3': "Geography", '4': "History", '5': "Entertainment", '6': "Sports"})
         self.assertTrue(res_data['categories'])
 
+    # Testing revalidating the categories with their ETag
+    def test_304_all_categories(self):
+        res = self.client().get('/categories')
+        etag = res.headers.get('ETag')
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertTrue(etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertFalse(res.data)
+
+    # Testing the hits and misses counters of the categories cache
+    def test_cache_stats(self):
+        self.client().get('/categories')
+        self.client().get('/categories')
+        res = self.client().get('/admin/cache')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res_data['categories']['hits'])
+        self.assertTrue(res_data['categories']['version'])
+
+    # Testing the connection pool instrumentation
+    def test_pool_stats(self):
+        self.client().get('/questions')
+        res = self.client().get('/admin/pool')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res_data['pool']['checkouts'])
+        self.assertIn('checked_out', res_data['pool'])
+        self.assertIn('p99', res_data['pool']['checkout_latency_ms'])
+
+    # Success Case (the replicas checkouts are not counted in the primary pool stats)
+    def test_pool_stats_per_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            primary_path = f'sqlite:///{directory}/primary.db'
+            replica_path = f'sqlite:///{directory}/replica.db'
+            for path in (replica_path, primary_path):
+                app = create_app({'SQLALCHEMY_DATABASE_URI': path, 'DB_CREATE_ALL': True})
+                with app.app_context():
+                    db.session.add(Category("Science"))
+                    db.session.add(Question("Which database?", "Answer", 1, 1))
+                    db.session.commit()
+            app = create_app({'SQLALCHEMY_DATABASE_URI': primary_path, 'SQLALCHEMY_REPLICA_URIS': [replica_path]})
+            checkouts = json.loads(app.test_client().get('/admin/pool').data)['pool']['checkouts']
+            app.test_client().get('/questions?ids=1')
+            res_data = json.loads(app.test_client().get('/admin/pool').data)
+            with app.app_context():
+                replica_checkouts = db.get_engine(app, bind='replica_0').pool.metrics.checkouts
+
+            self.assertEqual(res_data['pool']['checkouts'], checkouts)
+            self.assertEqual(replica_checkouts, 1)
+
+    # Testing the Server-Timing header and the Prometheus metrics
+    def test_metrics(self):
+        res = self.client().get('/questions')
+        self.assertIn('db;dur=', res.headers['Server-Timing'])
+
+        res = self.client().get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_http_request_duration_seconds_bucket{route="/questions",method="GET"', body)
+        self.assertIn('trivia_sql_statements_per_request_count{route="/questions",method="GET"}', body)
+
     #--------------------------------------
     # Testing getting question
     #--------------------------------------
@@ -65,6 +138,46 @@ class TriviaTestCase(unittest.TestCase):
         self.assertFalse(res_data['success'])
         self.assertTrue(res_data['error'])
 
+    # Success Case (a seeded page is cached and revalidated with its ETag)
+    def test_304_questions_with_seed(self):
+        res = self.client().get('/questions?page=1&seed=7')
+        same_res = self.client().get('/questions?page=1&seed=7')
+        not_modified_res = self.client().get('/questions?page=1&seed=7', headers={'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, same_res.data)
+        self.assertEqual(not_modified_res.status_code, 304)
+        self.assertEqual(not_modified_res.data, b'')
+
+    # Success Case (a write changes the data version so the cached page is built again)
+    def test_questions_with_seed_after_write(self):
+        res = self.client().get('/questions?page=1&seed=7')
+        self.client().post('/questions', json={'question': "Seeded?", 'answer': "Yes", 'category': 1, 'difficulty': 1})
+        new_res = self.client().get('/questions?page=1&seed=7', headers={'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(new_res.status_code, 200)
+        self.assertEqual(json.loads(new_res.data)['total_questions'], json.loads(res.data)['total_questions'] + 1)
+
+    # Success Case (cursor pagination)
+    def test_questions_with_cursor(self):
+        res = self.client().get('/questions?cursor=0')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res_data['total_questions'])
+        self.assertTrue(res_data['questions'])
+        self.assertTrue(all(question['id'] > 0 for question in res_data['questions']))
+        self.assertIn('next_cursor', res_data)
+
+    # Error Case (cursor pagination)
+    def test_404_questions_with_cursor(self):
+        res = self.client().get('/questions?cursor=100000')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res_data['message'], "Not found")
+        self.assertFalse(res_data['success'])
+
     # --------------------------------------
     # Testing deleting a question
     # --------------------------------------
@@ -88,6 +201,159 @@ class TriviaTestCase(unittest.TestCase):
         self.assertFalse(res_data['success'])
         self.assertTrue(res_data['error'])
 
+    # Success Case (batch delete)
+    def test_delete_questions_in_batch(self):
+        with self.app.app_context():
+            question = Question("Batch?", "Yes", 1, 1)
+            question.insert()
+            question_id = question.id
+        res = self.client().delete('/questions', json={'ids': [question_id, 100000]})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res_data['success'])
+        self.assertEqual(res_data['deleted_count'], 1)
+        self.assertEqual(res_data['results'], [{'id': question_id, 'status': 'deleted'},
+                                               {'id': 100000, 'status': 'not_found'}])
+
+    # Error Case (batch delete)
+    def test_422_delete_questions_in_batch(self):
+        res = self.client().delete('/questions', json={'ids': "foo"})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(res_data['success'])
+        self.assertTrue(res_data['error'])
+
+    # Error Case (batch delete of a float id, it must not be truncated to an existing id)
+    def test_422_delete_questions_in_batch_float_id(self):
+        res = self.client().delete('/questions', json={'ids': [5.5]})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(res_data['success'])
+        with self.app.app_context():
+            self.assertIsNotNone(Question.query.get(5))
+
+    # Error Case (batch fetch of an id that is not a string of digits)
+    def test_422_get_questions_by_ids(self):
+        res = self.client().get('/questions?ids=5,2.5')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(res_data['success'])
+
+    # Success Case (batch fetch)
+    def test_get_questions_by_ids(self):
+        res = self.client().get('/questions?ids=5,2,100000')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['id'] for question in res_data['questions']], [5, 2])
+        self.assertEqual(res_data['not_found_ids'], [100000])
+
+    # Error Case (batch fetch)
+    def test_404_get_questions_by_ids(self):
+        res = self.client().get('/questions?ids=100000,100001')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res_data['message'], "Not found")
+        self.assertFalse(res_data['success'])
+
+    # Success Case (the reads of a GET go to the replica, the reads outside a request to the primary)
+    def test_read_from_replica(self):
+        with tempfile.TemporaryDirectory() as directory:
+            primary_path = f'sqlite:///{directory}/primary.db'
+            replica_path = f'sqlite:///{directory}/replica.db'
+            for path, answer in ((replica_path, "Replica"), (primary_path, "Primary")):
+                app = create_app({'SQLALCHEMY_DATABASE_URI': path, 'DB_CREATE_ALL': True})
+                with app.app_context():
+                    db.session.add(Category("Science"))
+                    db.session.add(Question("Which database?", answer, 1, 1))
+                    db.session.commit()
+            app = create_app({'SQLALCHEMY_DATABASE_URI': primary_path, 'SQLALCHEMY_REPLICA_URIS': [replica_path]})
+            res = app.test_client().get('/questions?ids=1')
+            res_data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res_data['questions'][0]['answer'], "Replica")
+            with app.app_context():
+                self.assertEqual(Question.query.get(1).answer, "Primary")
+
+    # Success Case (a read that fails on a replica is run again on the primary)
+    def test_read_from_primary_when_replica_down(self):
+        with tempfile.TemporaryDirectory() as directory:
+            primary_path = f'sqlite:///{directory}/primary.db'
+            app = create_app({'SQLALCHEMY_DATABASE_URI': primary_path, 'DB_CREATE_ALL': True})
+            with app.app_context():
+                db.session.add(Category("Science"))
+                db.session.add(Question("Which database?", "Primary", 1, 1))
+                db.session.commit()
+            app = create_app({'SQLALCHEMY_DATABASE_URI': primary_path,
+                              'SQLALCHEMY_REPLICA_URIS': [f'sqlite:///{directory}/missing/replica.db']})
+            res = app.test_client().get('/questions?ids=1')
+            res_data = json.loads(res.data)
+            pool_data = json.loads(app.test_client().get('/admin/pool').data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res_data['questions'][0]['answer'], "Primary")
+            self.assertFalse(pool_data['replicas'][0]['healthy'])
+
+    # --------------------------------------
+    # Testing the startup
+    # --------------------------------------
+    # Success Case (the app doesn't create the tables, 'flask init-db' does)
+    def test_init_db_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/trivia.db'})
+            with app.app_context():
+                self.assertFalse(db.engine.has_table('questions'))
+            res = app.test_cli_runner().invoke(args=['init-db'])
+
+            self.assertEqual(res.exit_code, 0)
+            with app.app_context():
+                self.assertTrue(db.engine.has_table('questions'))
+
+    # Success Case (the caches are loaded before the first request)
+    def test_preload_caches(self):
+        category_cache.invalidate()
+        misses = category_cache.stats()['misses']
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'PRELOAD_CACHES': True})
+        self.assertEqual(category_cache.stats()['misses'], misses + 1)
+        res = app.test_client().get('/categories')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(category_cache.stats()['misses'], misses + 1)
+
+    # Testing serving the questions from the snapshot, the reads go to the database while it is stale
+    def test_questions_from_snapshot(self):
+        snapshot_path = f'{tempfile.mkdtemp()}/questions.snapshot'
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'QUESTION_SNAPSHOT_PATH': snapshot_path,
+                          'QUESTION_SNAPSHOT_REBUILD_DELAY': 60})
+        with app.app_context():
+            category_ids = {question.id for question in Question.query.filter(Question.category == 5)}
+        res = app.test_client().get('/categories/5/questions')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual({question['id'] for question in res_data['questions']}, category_ids)
+        self.assertEqual(snapshot_store.stats()['size'], Question.query.count())
+
+        data = {'question': "Which movie has the line 'You talking to me'?", 'answer': "Taxi Driver", 'category': 5,
+                'difficulty': 3}
+        question_id = json.loads(app.test_client().post('/questions', json=data).data)['question_id']
+        res_data = json.loads(app.test_client().get('/categories/5/questions').data)
+
+        self.assertTrue(snapshot_store.stats()['stale'])
+        self.assertIn(question_id, [question['id'] for question in res_data['questions']])
+
+        snapshot_store.rebuild()
+        res_data = json.loads(app.test_client().get('/categories/5/questions').data)
+
+        self.assertFalse(snapshot_store.stats()['stale'])
+        self.assertIn(question_id, [question['id'] for question in res_data['questions']])
+
     # --------------------------------------
     # Testing posting a question
     # --------------------------------------
@@ -107,6 +373,82 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(res_data['success'])
         self.assertTrue(res_data['question_id'])
 
+    # Testing the total questions counter after posting and deleting a question
+    def test_total_questions_after_writes(self):
+        total_before = json.loads(self.client().get('/questions').data)['total_questions']
+        data = {
+            'question': "Which planet in the solar system is the biggest?",
+            'answer': "Jupiter",
+            'category': 1,
+            'difficulty': 1,
+        }
+        res_data = json.loads(self.client().post('/questions', json=data).data)
+        self.assertEqual(res_data['total_questions'], total_before + 1)
+
+        res_data = json.loads(self.client().delete(f'/questions/{res_data["question_id"]}').data)
+        self.assertEqual(res_data['total_questions'], total_before)
+
+    # Success Case (a duplicated question is reported)
+    def test_post_duplicated_question(self):
+        data = {
+            'question': "whose autobiography is entitled I know why the caged bird sings",
+            'answer': "Maya Angelou",
+            'category': 4,
+            'difficulty': 2
+        }
+        res = self.client().post('/questions', json=data)
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertIn({'id': 5, 'similarity': 1.0, 'exact': True}, res_data['duplicates'])
+
+    # Error Case (a duplicated question is refused with DUPLICATE_POLICY 'reject')
+    def test_409_post_duplicated_question(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'DUPLICATE_POLICY': 'reject'})
+        data = {
+            'question': "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'",
+            'answer': "Maya Angelou",
+            'category': 4,
+            'difficulty': 2
+        }
+        res = app.test_client().post('/questions', json=data)
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertFalse(res_data['success'])
+        self.assertIn(5, [duplicate['id'] for duplicate in res_data['duplicates']])
+
+    # Success Case (the duplicates index catches up with the questions added and deleted by other processes)
+    def test_refresh_duplicate_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/trivia.db', 'DB_CREATE_ALL': True})
+            with app.app_context():
+                db.session.add(Category("Science"))
+                db.session.add(Question("Which planet is known as the red planet?", "Mars", 1, 1))
+                db.session.add(Question("What is the boiling point of water?", "100", 1, 1))
+                db.session.commit()
+                duplicate_index.invalidate()
+                duplicate_index.refresh()
+                # Writing the table directly, the way another process would, so the index is not notified
+                text = "Which gas do the plants absorb from the air?"
+                db.session.execute(Question.__table__.insert(), [{'question': text, 'answer': "Carbon dioxide",
+                                                                  'category': 1, 'difficulty': 2,
+                                                                  'content_hash': content_hash(text)}])
+                db.session.execute(Question.__table__.delete().where(Question.id == 1))
+                db.session.commit()
+                exact_duplicates = duplicate_index.find("which gas do the plants absorb from the air")
+                duplicate_index.refresh()
+                near_duplicates = duplicate_index.find("Which gas do the plants absorb from air?")
+
+                self.assertEqual(Question.query.get(2).content_hash, content_hash("What is the boiling point of water"))
+                self.assertEqual(Question.query.get(2).minhash, minhash_signature("What is the boiling point of water?"))
+                # The question written without a signature got it stored by the refresh
+                self.assertEqual(Question.query.get(3).minhash, minhash_signature(text))
+                self.assertEqual(exact_duplicates, [{'id': 3, 'similarity': 1.0, 'exact': True}])
+                self.assertEqual([duplicate['id'] for duplicate in near_duplicates], [3])
+                self.assertEqual(duplicate_index.size(), 2)
+                duplicate_index.invalidate()
+
     # Error Case 1
     def test_422_post_question(self):
         res = self.client().post('/questions', json='foo bar baz')
@@ -117,6 +459,58 @@ class TriviaTestCase(unittest.TestCase):
         self.assertFalse(res_data['success'])
         self.assertTrue(res_data['error'])
 
+    # Error Case 2
+    def test_422_post_question_unknown_category(self):
+        data = {
+            'question': "Which planet in the solar system is the biggest?",
+            'answer': "Jupiter",
+            'category': 1000,
+            'difficulty': 1,
+        }
+        res = self.client().post('/questions', json=data)
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(res_data['success'])
+
+    # --------------------------------------
+    # Testing importing and exporting questions in bulk
+    # --------------------------------------
+    # Success Case
+    def test_bulk_import_questions(self):
+        data = [
+            {'question': "Who painted the Mona Lisa?", 'answer': "Leonardo da Vinci", 'category': 2, 'difficulty': 1},
+            {'question': "What is the capital of Peru?", 'answer': "Lima", 'category': 3, 'difficulty': 2},
+            {'question': "Invalid row", 'answer': "No category", 'difficulty': 2},
+        ]
+        res = self.client().post('/questions/bulk', json=data)
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertTrue(res_data['success'])
+        self.assertEqual(res_data['inserted'], 2)
+        self.assertEqual(res_data['failed'], 1)
+        self.assertEqual(res_data['errors'][0]['row'], 3)
+
+    # Error Case
+    def test_422_bulk_import_questions(self):
+        res = self.client().post('/questions/bulk', data="question,answer\nfoo,bar\n", content_type='text/csv')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(res_data['success'])
+        self.assertTrue(res_data['errors'])
+
+    # Success Case
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(lines)
+        self.assertTrue(json.loads(lines[0])['question'])
+
     # --------------------------------------
     # Testing searching a question
     # --------------------------------------
@@ -132,6 +526,33 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(res_data['questions'])
         self.assertTrue(res_data['current_category'])
 
+    # Success Case (searching the answers too)
+    def test_search_question_with_answers(self):
+        data = {
+            'searchTerm': "Fight Club",
+            'includeAnswers': True
+        }
+        self.client().post('/questions', json={
+            'question': "What is the movie that was released in 1999 and had Edward Norton and Brad Pitt?",
+            'answer': "Fight Club",
+            'category': 5,
+            'difficulty': 2,
+        })
+        res = self.client().post('/questions/search', json=data)
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res_data['total_questions'])
+        self.assertTrue(any(question['answer'] == "Fight Club" for question in res_data['questions']))
+
+    # Error Case (page after the last page of results)
+    def test_404_search_question_page(self):
+        res = self.client().post('/questions/search?page=1000', json={'searchTerm': "Norton"})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res_data['total_questions'], 0)
+
     # Error Case
     def test_422_search_question(self):
         res = self.client().post('/questions/search', json='foo bar baz')
@@ -155,6 +576,52 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(res_data['questions'])
         self.assertTrue(res_data['current_category'])
 
+    # Success Case (the rows are serialized like Question.format())
+    def test_get_question_in_category_format(self):
+        res = self.client().get('/categories/4/questions')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        with self.app.app_context():
+            question = Question.query.get(res_data['questions'][0]['id'])
+            self.assertEqual(res_data['questions'][0], question.format())
+
+    # Success Case (the json module encodes the same document as orjson)
+    def test_get_question_in_category_json_encoder(self):
+        json_app = create_app({'JSON_ENCODER_BACKEND': 'json', 'SQLALCHEMY_DATABASE_URI': self.database_path})
+        res = json_app.test_client().get('/categories/4/questions')
+        default_res = self.client().get('/categories/4/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['total_questions'], json.loads(default_res.data)['total_questions'])
+        self.assertEqual(sorted(json.loads(res.data)['questions'], key=lambda question: question['id']),
+                         sorted(json.loads(default_res.data)['questions'], key=lambda question: question['id']))
+
+    # Success Case (a category above LISTING_STREAM_THRESHOLD is streamed, the envelope stays the same)
+    def test_get_question_in_category_streamed(self):
+        stream_app = create_app({'LISTING_STREAM_THRESHOLD': 1, 'SQLALCHEMY_DATABASE_URI': self.database_path})
+        res = stream_app.test_client().get('/categories/4/questions')
+        res_data = json.loads(res.data)
+        default_res_data = json.loads(self.client().get('/categories/4/questions').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Content-Length', res.headers)
+        self.assertEqual(res_data['total_questions'], default_res_data['total_questions'])
+        self.assertEqual(res_data['current_category'], 4)
+        self.assertEqual(sorted(question['id'] for question in res_data['questions']),
+                         sorted(question['id'] for question in default_res_data['questions']))
+
+    # Success Case (the clients accepting gzip get a compressed body)
+    def test_get_question_in_category_gzip(self):
+        gzip_app = create_app({'COMPRESSION_MIN_SIZE': 1, 'SQLALCHEMY_DATABASE_URI': self.database_path})
+        res = gzip_app.test_client().get('/categories/4/questions', headers={'Accept-Encoding': 'gzip'})
+        res_data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertTrue(res_data['questions'])
+
     # Error Case
     def test_404_get_question_in_category(self):
         res = self.client().get('/categories/22/questions')
@@ -182,6 +649,24 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
 
+    # Success Case (all the questions in the category were asked)
+    def test_play_game_category_exhausted(self):
+        res = self.client().get('/categories/6/questions')
+        questions_ids = [question['id'] for question in json.loads(res.data)['questions']]
+        data = {
+            "quiz_category": {
+                "id": 6,
+                "type": "Sports"
+            },
+            "previous_questions": questions_ids
+        }
+        res = self.client().post('/quizzes', json=data)
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res_data['total_questions'], len(questions_ids))
+        self.assertIsNone(res_data['question'])
+
     # Error Case
     def test_422_play_game(self):
         data = {
@@ -199,6 +684,285 @@ class TriviaTestCase(unittest.TestCase):
         self.assertFalse(res_data['success'])
         self.assertTrue(res_data['error'])
 
+    # Success Case (adaptive difficulty, one level up after a correct answer)
+    def test_play_game_adaptive_difficulty(self):
+        data = {
+            "quiz_category": {
+                "id": 0,
+                "type": "click"
+            },
+            "previous_questions": [],
+            "difficulty": 2,
+            "last_answer_correct": True
+        }
+        res = self.client().post('/quizzes', json=data)
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res_data['target_difficulty'], 3)
+        self.assertEqual(res_data['question']['difficulty'], 3)
+
+    # Error Case (the difficulty is out of range)
+    def test_422_play_game_difficulty(self):
+        data = {
+            "quiz_category": {
+                "id": 0,
+                "type": "click"
+            },
+            "previous_questions": [],
+            "difficulty": 9
+        }
+        res = self.client().post('/quizzes', json=data)
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(res_data['success'])
+        self.assertTrue(res_data['error'])
+
+    # Success Case (the questions index catches up with the questions added and deleted by other processes)
+    def test_refresh_question_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/trivia.db', 'DB_CREATE_ALL': True})
+            with app.app_context():
+                db.session.add(Category("Science"))
+                for number in range(3):
+                    db.session.add(Question(f"Question {number}?", "Answer", 1, 2))
+                db.session.commit()
+                question_index.invalidate()
+                loaded_count = question_index.count(0)
+                # Writing the table directly, the way another process would, so the index is not notified
+                db.session.execute(Question.__table__.insert(), [{'question': "New?", 'answer': "Answer",
+                                                                  'category': 1, 'difficulty': 4}])
+                db.session.execute(Question.__table__.delete().where(Question.id == 1))
+                db.session.commit()
+                stale_count = question_index.count(0)
+                question_index.refresh()
+
+                self.assertEqual(loaded_count, 3)
+                self.assertEqual(stale_count, 3)
+                self.assertEqual(sorted(question_index.ids(0)), [2, 3, 4])
+                self.assertEqual(question_index.count(1, 4), 1)
+                question_index.invalidate()
+
+    # --------------------------------------
+    # Testing recording the quiz results
+    # --------------------------------------
+    # Success Case (the buffered results are added to the stats once written)
+    def test_record_quiz_results(self):
+        stats = json.loads(self.client().get('/questions/5/stats').data)
+        data = {
+            "answers": [
+                {"question_id": 5, "correct": True},
+                {"question_id": 5, "correct": False}
+            ]
+        }
+        res = self.client().post('/quizzes/results', json=data)
+        res_data = json.loads(res.data)
+        results_buffer.flush()
+        new_stats = json.loads(self.client().get('/questions/5/stats').data)
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(res_data['accepted'], 2)
+        self.assertEqual(new_stats['plays'], stats['plays'] + 2)
+        self.assertEqual(new_stats['correct'], stats['correct'] + 1)
+        self.assertEqual(new_stats['category']['plays'], stats['category']['plays'] + 2)
+
+    # Error Case (the buffer is full)
+    def test_503_record_quiz_results(self):
+        # The buffer is shared by the apps, restoring its size even if an assertion fails
+        self.addCleanup(setattr, results_buffer, 'max_size', RESULTS_BUFFER_SIZE)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'QUIZ_RESULTS_BUFFER_SIZE': 1})
+        res = app.test_client().post('/quizzes/results', json={"answers": [{"question_id": 5, "correct": True}] * 2})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertTrue(res.headers['Retry-After'])
+        self.assertFalse(res_data['success'])
+
+    # Error Case (the answers are kept when writing them fails with an error that is not a database error)
+    def test_record_quiz_results_write_error(self):
+        results_buffer.flush()
+        with mock.patch('results.write_answers', side_effect=RuntimeError("write failed")):
+            res = self.client().post('/quizzes/results', json={"answers": [{"question_id": 5, "correct": True}]})
+            with self.assertRaises(RuntimeError):
+                results_buffer.flush()
+            buffered = results_buffer.stats()['buffered']
+        results_buffer.flush()
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(buffered, 1)
+        self.assertEqual(results_buffer.stats()['buffered'], 0)
+
+    # Error Case
+    def test_422_record_quiz_results(self):
+        res = self.client().post('/quizzes/results', json={"answers": [{"question_id": 5, "correct": "yes"}]})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(res_data['success'])
+        self.assertTrue(res_data['error'])
+
+    # Error Case (an answer without a question_id or with a float one)
+    def test_422_record_quiz_results_invalid_question_id(self):
+        for answer in ({"correct": True}, {"question_id": 1.7, "correct": True}, {"question_id": "5", "correct": True}):
+            res = self.client().post('/quizzes/results', json={"answers": [answer]})
+            res_data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertFalse(res_data['success'])
+
+    # Error Case
+    def test_404_question_stats(self):
+        res = self.client().get('/questions/100000/stats')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res_data['message'], "Not found")
+        self.assertFalse(res_data['success'])
+
+    # --------------------------------------
+    # Testing profiling a request
+    # --------------------------------------
+    # Success Case
+    def test_profile_request(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'PROFILE_TOKEN': "secret"})
+        res = app.test_client().post('/quizzes', json={"quiz_category": {"id": 0}, "previous_questions": []},
+                                     headers={'X-Profile': "secret"})
+        profile_id = res.headers['X-Profile-Id']
+        profiles_res = app.test_client().get('/admin/profiles', headers={'X-Profile': "secret"})
+        profiles = json.loads(profiles_res.data)['profiles']
+        profile = app.test_client().get(f'/admin/profiles/{profile_id}', headers={'X-Profile': "secret"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(profiles[0]['id'], int(profile_id))
+        self.assertEqual(profiles[0]['endpoint'], 'play_game')
+        self.assertEqual(profile.status_code, 200)
+        self.assertIn('get_next_question', profile.data.decode())
+
+    # Success Case (the requests without the token are not profiled)
+    def test_request_not_profiled(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'PROFILE_TOKEN': "secret"})
+        res = app.test_client().post('/quizzes', json={"quiz_category": {"id": 0}, "previous_questions": []},
+                                     headers={'X-Profile': "guess"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('X-Profile-Id', res.headers)
+
+    # Error Case (cProfile can't tell the greenlets of a request apart under gevent)
+    def test_cprofile_refused_under_gevent(self):
+        with self.assertRaises(ValueError):
+            create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'PROFILE_TOKEN': "secret",
+                        'SERVING_MODE': 'gevent', 'PROFILER': 'cprofile'})
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'PROFILE_TOKEN': "secret",
+                          'SERVING_MODE': 'gevent'})
+        res = app.test_client().get('/categories', headers={'X-Profile': "secret"})
+        profiles_res = app.test_client().get('/admin/profiles', headers={'X-Profile': "secret"})
+        profiles = json.loads(profiles_res.data)['profiles']
+
+        self.assertEqual(profiles[0]['id'], int(res.headers['X-Profile-Id']))
+        self.assertEqual(profiles[0]['profiler'], 'sampling')
+
+    # Error Case
+    def test_404_get_profile(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'PROFILE_TOKEN': "secret"})
+        res = app.test_client().get('/admin/profiles/100000', headers={'X-Profile': "secret"})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res_data['message'], "Not found")
+        self.assertFalse(res_data['success'])
+
+    # Error Case (the profiles are hidden from the requests without the token)
+    def test_404_get_profiles_without_token(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'PROFILE_TOKEN': "secret"})
+        res = app.test_client().get('/admin/profiles', headers={'X-Profile': "guess"})
+        unconfigured_res = self.client().get('/admin/profiles')
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(unconfigured_res.status_code, 404)
+
+    # --------------------------------------
+    # Testing the admission control
+    # --------------------------------------
+    # Success Case (the high priority routes keep flowing while a route is shed)
+    def test_admission_keeps_categories_flowing(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'ADMISSION_ROUTE_LIMITS': {'play_game': 0},
+                          'ADMISSION_CLIENT_RATE': 1})
+        for _ in range(5):
+            res = app.test_client().get('/categories')
+            self.assertEqual(res.status_code, 200)
+
+    # Error Case 1 (the client is over its rate)
+    def test_429_search_questions(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'ADMISSION_CLIENT_RATE': 1,
+                          'ADMISSION_CLIENT_BURST': 2})
+        res = app.test_client().post('/questions/search', json={"searchTerm": "title"})
+        res = app.test_client().post('/questions/search', json={"searchTerm": "title"})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertTrue(res.headers['Retry-After'])
+        self.assertFalse(res_data['success'])
+        self.assertEqual(res_data['error'], 429)
+
+    # Success Case (the requests are admitted without rate limit while the buckets backend fails)
+    def test_admission_backend_failure(self):
+        class FailingBackend:
+            def take(self, key, cost, rate, burst):
+                raise ConnectionError("the limiter backend is down")
+
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'ADMISSION_CLIENT_RATE': 1,
+                          'ADMISSION_BACKEND': FailingBackend()})
+        res = app.test_client().post('/questions/search', json={"searchTerm": "title"})
+        categories_res = app.test_client().get('/categories')
+        stats = json.loads(app.test_client().get('/admin/admission').data)['admission']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(categories_res.status_code, 200)
+        self.assertEqual(stats['backend_errors'], 1)
+
+    # Error Case 2 (the route is over its concurrency limit)
+    def test_503_play_game(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'ADMISSION_ROUTE_LIMITS': {'play_game': 0}})
+        res = app.test_client().post('/quizzes', json={"quiz_category": {"id": 0}, "previous_questions": []})
+        res_data = json.loads(res.data)
+        stats = json.loads(app.test_client().get('/admin/admission').data)['admission']
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertFalse(res_data['success'])
+        self.assertEqual(stats['shed'], {'play_game': 1})
+
+    # --------------------------------------
+    # Testing playing the game with a server side session
+    # --------------------------------------
+    # Success Case
+    def test_play_game_with_session(self):
+        res = self.client().post('/quizzes/sessions', json={"quiz_category": {"id": 6, "type": "Sports"}})
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertTrue(res_data['session_id'])
+        total_questions = res_data['total_questions']
+        asked_questions_ids = []
+        for _ in range(total_questions):
+            res = self.client().post(f'/quizzes/sessions/{res_data["session_id"]}/next')
+            question = json.loads(res.data)['question']
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn(question['id'], asked_questions_ids)
+            asked_questions_ids.append(question['id'])
+        res = self.client().post(f'/quizzes/sessions/{res_data["session_id"]}/next')
+        self.assertIsNone(json.loads(res.data)['question'])
+
+    # Error Case
+    def test_404_play_game_with_session(self):
+        res = self.client().post('/quizzes/sessions/foo/next')
+        res_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res_data['message'], "Not found")
+        self.assertFalse(res_data['success'])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -14,6 +14,8 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      // The same seed gives the same shuffle, the server caches the listings per seed
+      seed: Math.floor(Math.random() * 1000000),
     };
   }
 
@@ -23,7 +25,7 @@ class QuestionView extends Component {
 
   getQuestions = () => {
     $.ajax({
-      url: `/questions?page=${this.state.page}`,
+      url: `/questions?page=${this.state.page}&seed=${this.state.seed}`,
       type: "GET",
       success: (result) => {
         this.setState({
@@ -67,7 +69,7 @@ class QuestionView extends Component {
 
   getByCategory = (id) => {
     $.ajax({
-      url: `/categories/${id}/questions`,
+      url: `/categories/${id}/questions?seed=${this.state.seed}`,
       type: "GET",
       success: (result) => {
         this.setState({
@@ -98,6 +98,7 @@ class QuizView extends Component {
       .replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g, "")
       .toLowerCase();
     let evaluate = this.evaluateAnswer();
+    this.recordResult(evaluate);
     this.setState((oldState) => {
       return {
         numCorrect: !evaluate ? oldState.numCorrect : oldState.numCorrect + 1,
@@ -106,6 +107,19 @@ class QuizView extends Component {
     });
   };
 
+  recordResult = (correct) => {
+    // The results only feed the questions stats, the game goes on if they can't be recorded
+    $.ajax({
+      url: "/quizzes/results",
+      type: "POST",
+      dataType: "json",
+      contentType: "application/json",
+      data: JSON.stringify({
+        answers: [{ question_id: this.state.currentQuestion.id, correct: correct }],
+      }),
+    });
+  };
+
   restartGame = () => {
     this.setState({
       quizCategory: null,